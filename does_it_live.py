@@ -15,6 +15,7 @@
  This script was developed on Linux and Arista EOS 4.21.
  Both python2 and python3 were tested on Linux
  DNS python is required
+ jsonrpclib is required by --throttle only (it comes with EOS)
 
 
  # Instructions #
@@ -42,8 +43,25 @@ sudo python setup.py install
  ## 3 - Syntax
 
  ./does_it_live.py  [-h] [-v] [-V] [-i <time>] [-t <time>] 
-                    [-m icmp | dns [-d <dns ip>]] [-s <ip add>]
-                    [-D <count>] host
+                    [-m icmp | dns [-d <dns ip>[,...]] [--race] [-r <type>]
+                    [-e <answers>]
+                    | tcp [-p <port>]
+                    [--banner <regex>] | http [--status <regex>]
+                    [--insecure]] [-s <ip add>]
+                    [-D <count>] [-T <msec>] [--confirm <time>]
+                    [--backoff <time>] [--max-pps <rate>]
+                    [--max-bytes <rate>] [--priority critical | normal | low]
+                    [--throttle <percent>]
+                    [--parent <name> [--unreachable-every <count>]]
+                    [-b <count> [--spacing <msec>] [-L <percent>]]
+                    [-w <count>] [-H <count>] [-P <time>]
+                    [-I <file> [--show-plan]]
+                    [-c <file>] [-n <sink> [-n <sink> ...]] [--queue <count>]
+                    [--drop newest | oldest] [-C <sec>]
+                    [--correlate-by prefix | source | tag]
+                    [--flap <count> [--flap-period <sec>]]
+                    [--state <file> [--state-interval <sec>]] [host [host ...]]
+ ./does_it_live.py  --trap-receiver [<ip add>:]<port>
 
  -v (--verbose) aims at providing basic information to verify the functionality
                 of the script. Someone would typically use this option before
@@ -52,18 +70,108 @@ sudo python setup.py install
  -V (--veryVerbose) would be used for troubleshooting the software development
                 or the operation of the script
 
- -i (--interval) time in seconds between each health check
+ -i (--interval) time in seconds between each health check. Fractions of a
+                second are accepted. Checks start at a fixed pace, so the
+                duration of a check (e.g. a timeout) does not delay the next
 
  -t (--timeout) time in seconds before declaring a single health check as 
-                failed
+                failed. Fractions of a second are accepted
 
- -m (--mode)    operating mode of the health check. ICMP and DNS are 
+ -m (--mode)    operating mode of the health check. ICMP, DNS, TCP and HTTP are
                 supported. If running in ICMP mode, which is the default, then 
                 only the host is required. When using DNS mode, then the DNS 
                 server is additionally required.
+                ICMP echos are sent natively from a raw socket (root, as on
+                EOS) or an unprivileged ICMP socket. If neither can be opened
+                the ping command is used instead.
+                All the ICMP targets share one socket per source address, so
+                thousands of targets can be probed from a single process.
+                With Python 3 on Linux, RTTs end at the kernel receive
+                timestamp of the reply (SO_TIMESTAMPNS) rather than when the
+                script reads it, so a busy CPU does not inflate them. The
+                correction applied is displayed with -V and in the SIGUSR1
+                report.
+                The DNS mode queries the -r (--record) type of the host: A
+                (default), AAAA, SOA, NS or CNAME. Its latency is the query
+                RTT. With -e (--expect), a comma separated list of answers
+                (addresses, names or SOA serial), any other answer degrades
+                the target (see -T) as a hijacked or stale record. Failures
+                are told apart: timeout, NXDOMAIN, SERVFAIL, REFUSED or an
+                empty answer, in verbose mode, in the syslog message of a
+                dead target and in the SIGUSR1 report.
+                Several comma separated name-servers (-d) are queried at once,
+                the check lasting as long as the slowest one: the target is
+                alive while one of them answers, and degraded when another
+                fails, or when its SOA serial is behind (a lagging secondary,
+                with -r SOA). With --race, the first valid answer completes
+                the check. The status and RTT of each name-server are in the
+                SIGUSR1 report.
+                The TCP mode connects to the -p (--port) of the host, 22 (SSH)
+                by default, the latency being the connect time. With --banner
+                the first line sent by the server must also match the regular
+                expression given, e.g. '^SSH-'. Connections are made without
+                blocking, thousands at a time, and closed with a reset.
+                In the HTTP mode the host is a URL (http:// or https://),
+                whose status code must match --status ('[23]' by default, i.e.
+                2xx or 3xx). The latency is the total time of the request,
+                the status and time to first byte are displayed in verbose
+                mode and in the SIGUSR1 report. Connections are kept alive
+                from one check to the next and TLS sessions resumed, so the
+                checks do not pay a handshake each. --insecure skips the
+                verification of the certificates.
 
  -s (--source)  the source IP address of the IP query can be specified
 
+ -T (--threshold) RTT in ms over which a responding target is 'degraded'. The
+                RTT of each successful check is compared with it, and the
+                degraded state has its own dampening: the dampening
+                count of consecutive checks over the threshold degrade the
+                target, and the same count under it clear the degradation.
+                Unexpected DNS answers (see -e) count as over the threshold.
+
+ --parent       name of the target the others depend on, e.g. their gateway
+                (given as a host too), or the 'parent' of each probe of an
+                inventory. While a parent is down, dead or itself behind a
+                dead parent, its children are only checked every
+                --unreachable-every intervals (10 by default, 0 never), and a
+                child dying is reported 'unreachable-via-parent' instead of
+                dead. A child dying while its parent is failing waits for the
+                parent to be declared dead or to respond. Once the parent is
+                back, an unreachable child still failing for its dampening
+                count is reported dead. A change of state of a parent only
+                goes through its children, and their children while their
+                state changes.
+
+ -b (--burst)   amount of ICMP echos sent per check, --spacing msec apart
+                (default 20). The check succeeds when the loss of the burst is
+                at most -L (--loss) percent (default 50), so a single lost echo
+                on a lossy but usable path does not count as a failure. The
+                RTT of the check is the average of the replies. The loss,
+                jitter (RFC 3550) and reordered replies of the last burst are
+                displayed in verbose mode and in the SIGUSR1 report. Bursts
+                need native ICMP sockets: the ping command fallback sends a
+                single echo.
+
+ -w (--workers) amount of checks that can be in progress at the same time when
+                several hosts are monitored. A slow or timed-out target only
+                holds one of them, so it never delays the other targets.
+
+ -H (--history) amount of RTTs kept per target, 4 bytes each. A target object
+                and its check take about 300 bytes (Python 3), displayed per
+                mode in verbose mode with a warning over that budget. With
+                its configuration strings, dampening state, RTT history and
+                entries in the scheduler and indexes, a target takes about
+                650 bytes (ICMP) to 750 bytes, plus about 330 bytes for the
+                percentiles (see -P), as measured at 100k targets.
+
+ -P (--percentiles) window in seconds of the RTT percentiles kept for each
+                target (p50, p90, p99 and max, within 12.5%). They cover the
+                current window and the previous ones decayed, the last
+                complete window weighing half (the max covers these two
+                windows), in one histogram of about 330 bytes per target.
+                Sending SIGUSR1 prints them for all the targets. Default is
+                300, 0 disables them.
+
  -D (--dampening) amount of consecutive checks before switching the target from
                 one state to another, either alive->dead or dead->alive. 
                 The dampening count applies for both direction of change.
@@ -76,6 +184,114 @@ sudo python setup.py install
                 are ignored and 3 entirely new failures will be needed to 
                 change the target status.
 
+ --confirm      interval in seconds of the checks following a failure of an
+                alive target (or a success of a dead one), until the dampening
+                confirms or cancels the change of state. A target is then
+                declared dead in about dampening x confirm seconds, instead of
+                dampening x interval. Default is none, the interval.
+
+ --backoff      longest interval in seconds of the checks of a dead target.
+                The interval doubles with each failure once the target is
+                dead, up to the backoff, and is back to normal as soon as the
+                target answers. Default is none, the interval.
+                Both can be set per probe in an inventory; the current
+                interval of a target is the 'cadence' of the SIGUSR1 report,
+                when not its interval.
+
+ --max-pps      packets, and --max-bytes bytes (IP headers included), per
+                second sent by all the checks together, whatever their mode,
+                so that the probes stay under the control plane policing
+                (CoPP) of the switches instead of being dropped and counted as
+                failures. Up to 0.1 s of the rates can be sent at once. Each
+                target has a --priority class (or the 'priority' of its
+                probe): critical checks always go, normal ones wait for the
+                rate, low ones also leave half of the 0.1 s to the others. A
+                check still waiting when its next one is due is shed, never
+                counted as a failure. The checks admitted, deferred and shed
+                of each class are in the SIGUSR1 report. No limit by default.
+
+ --throttle     CPU usage (percent) of the switch over which the checks slow
+                down. The CPU usage and the CoPP drops are read from the local
+                eAPI every 10 seconds (as the admin user over http, see the
+                eapi settings at the top of the script). While the CPU is over
+                the value given or CoPP drops packets, the probe rate is
+                halved at each reading, down to 1/16: the intervals of the
+                targets (but the critical ones) are stretched, and the bursts
+                and the --max-pps and --max-bytes rates reduced. It doubles
+                back, up to normal, at each reading with the CPU under 3/4 of
+                the value and no drops. Failures seen while throttled are
+                flagged in verbose mode, and the death of a target (but a
+                critical one) is only notified if it is still dead one
+                interval after the rate is back to normal, or after 3 more
+                checks (at their stretched interval) at most: our own load is
+                not reported as an outage, a real one still is. The readings,
+                rate and failures flagged are in the SIGUSR1 report.
+
+ -I (--ipsla)   Cisco configuration whose IP SLA monitors are checked, in
+                addition to the hosts given. See example 4.
+
+ -c (--config)  inventory file of probes to check, in addition to the hosts
+                given. See example 5.
+
+ -n (--notify)  where the notifications (changes of state) are sent, can be
+                repeated: syslog (local, the default), udp://host[:port] or
+                tcp://host[:port] for a remote RFC 5424 syslog server (port
+                514 by default, the TCP connection being kept),
+                snmp://[community@]host[:port] for SNMPv2c traps (community
+                public and port 162 by default), or json:FILE to append JSON
+                lines, with the fields below, to a file. Notifications are
+                queued and sent in the background, in batches, so a slow sink
+                never delays the checks. At most --queue messages wait (10000
+                by default), beyond which the --drop newest (default) or oldest
+                are dropped. Their counters are in the SIGUSR1 report: sent
+                (to a sink at least), failed (on every sink), dropped, and
+                the errors of each sink.
+                A trap has the OID 1.3.6.1.4.1.2021.991.0.1 and the fields
+                1.3.6.1.4.1.2021.991.1.1 to .1.7: target, mode, state (alive,
+                dead, degraded or normal), RTT (Gauge32 in usec, 0 if none),
+                tag, count (Gauge32, the targets of an aggregated event, or
+                1) and name (of the probe, the host if unnamed). Only the
+                request ID, sysUpTime and these values are encoded per trap,
+                the rest is encoded once.
+
+ -C (--correlate) window in seconds over which the changes of state are held
+                and correlated, 0 by default (no correlation). The changes to
+                a same state of the targets of a same --correlate-by group,
+                their /24 (IPv4) or /64 (IPv6) prefix by default, their source
+                or their tag, are notified as one aggregated event with their
+                count and names (the first 20 in the message, all of them in
+                the JSON 'members'), e.g. when an upstream link dies. A single
+                change is notified as usual, once the window is over. A target
+                changing back within the window (e.g. dead then alive) is not
+                notified at all.
+
+ --flap         notifications per target and --flap-period (600 s by default),
+                at most. A target beyond the limit is muted until the end of
+                the period, then its last change of state is notified with the
+                number of changes muted. 0 by default (no limit). The
+                aggregated and muted changes are counted in the SIGUSR1 report.
+
+ --state        file where the dampening state of the targets (state, counters,
+                last RTT and time of the last change) is saved every
+                --state-interval (60 s by default) and on exit (Ctrl-C or
+                SIGTERM), and restored from on start: a restart neither
+                notifies the dead targets again nor restarts a dampening in
+                progress. It holds one 44-byte record per target, written in
+                place and only when the state of the target changed, so a
+                flash disk wears little. A record torn by a crash is ignored,
+                that target starts alive. An existing file which is not a
+                state file of this version is refused, never overwritten.
+                Its records saved and written are in the SIGUSR1 report.
+
+ --trap-receiver  listens for SNMP traps on the UDP port (of 127.0.0.1 by
+                default) and prints them as JSON lines instead of checking
+                targets, e.g. to test '-n snmp://127.0.0.1:1162' without an
+                SNMP manager.
+
+ host           one or several targets. Each target is checked on its own
+                schedule and keeps its own dampening state, so a single
+                process can monitor hundreds of hosts.
+
 
 Dampening example - target is considered still alive:
     Success Success Fail Success Fail Fail Success
@@ -88,8 +304,10 @@ Dampening example - target becomes considered as dead:
                           Declared dead                      Still dead
                 
 Dampening example - target recovers from dead to alive (resurects):
-    Success Fail Fail Fail Success Fail Success Success Success
-                                                              ^ target is back alive 
+    Success Fail Fail Fail Success Fail Success Success Success Success
+                                                                      ^ target is back alive 
+ Once dead, the dampening count of successes is followed by the success which
+ confirms the recovery, as in the script output of example 1.
 
 
  ## 4 - Usage examples:
@@ -156,27 +374,195 @@ Oct 12 08:52:50 localhost does_it_live: %DOES_IT_LIVE-5-LOG: Log msg: Target www
 ### Example 3 - Python 3
 Try python3 on your host in such fashion:
 python3 does_it_live.py -v -t1 -i1 -m dns -d 1.1.1.1  www.w3.org
+
+### Example 4 - Cisco IP SLA migration
+The 'ip sla monitor' entries of a Cisco configuration (icmpEcho and dns types)
+are compiled into probes: frequency becomes the interval, timeout is converted
+from msec, threshold is the RTT threshold (see -T), the tag is added to the
+syslog messages and 'react timeout threshold-type consecutive <n>' becomes the
+dampening.
+Probes sharing a source address and a frequency are grouped, so that each
+group is checked at once over the shared sockets.
+
+./does_it_live.py --show-plan -I 'ip sla.txt'      <=== review the plan
+./does_it_live.py -v -I 'ip sla.txt'
+
+### Example 5 - Inventory of probes
+Thousands of probes can be described in a single JSON (or YAML, when PyYAML is
+installed) file. Each probe takes the same settings as the command line
+(name, host, mode, interval, timeout, dampening, threshold, burst, spacing,
+loss, source, dns, tag, parent, confirm, backoff, priority); those not given
+come from the 'defaults' of the file, then from the command line.
+A probe plan displayed by --show-plan is also a valid inventory.
+
+{
+  "defaults": {"interval": 5, "timeout": 2},
+  "probes": [
+    {"host": "8.8.8.8", "tag": "google"},
+    {"name": "w3-dns", "host": "www.w3.org", "mode": "dns", "dns": "1.1.1.1"},
+    {"name": "gw", "host": "192.0.2.1"},
+    {"host": "192.0.2.10", "parent": "gw"}
+  ]
+}
+
+./does_it_live.py -c probes.json &
+kill -HUP <pid>                   <=== after editing probes.json
+
+The probes are identified by their name (the host by default). On SIGHUP only
+the differences are applied: new probes start, removed probes stop, and the
+others keep their schedule and dampening state, even when their interval,
+timeout, dampening, threshold, tag or parent changed.
 '''
 
 import argparse
+import array
+import collections
+import errno
+import fcntl
+import heapq
+import itertools
+import json
 import logging
+import math
+import mmap
 import os
 import platform
+import random
 import re
+import select
 import signal
 import socket
+import ssl
+import struct
 import subprocess
 import sys
 import syslog
+import threading
 import time
-# dns.resolver requires installing DNSPython (see install instructions)
-import dns.resolver
+import zlib
+# Python 2 compatibility for running on EOS
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+# YAML inventories are optional, JSON is always supported
+try:
+    import yaml
+except ImportError:
+    yaml = None
+# NumPy is optional, it vectorizes the dampening of large target sets
+try:
+    import numpy
+except ImportError:
+    numpy = None
+# jsonrpclib is optional, it reads the control plane load for --throttle
+try:
+    import jsonrpclib
+except ImportError:
+    jsonrpclib = None
+# dns requires installing DNSPython (see install instructions)
+import dns.exception
+import dns.flags
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rdatatype
 
 # Global configuration settings
 # logStr is a formatting pattern used by str.format() to align outputs
 logStr = '{:27} {}'
 # syslogFormat can be customised to match syslog preferences
 syslogFormat = '%DOES_IT_LIVE-5-LOG'
+# Facility and severity of the syslog messages, local and remote
+syslogPriority = syslog.LOG_LOCAL4 | syslog.LOG_NOTICE
+# Notifications waiting to be sent, at most, and sent at once, at most
+noticeQueueSize = 10000
+noticeBatch = 256
+# OID of the SNMP traps of a change of state, and of their varbinds (the
+# fields of the notification): trap OID + .1.<index in snmpFields>
+snmpTrapOid = '1.3.6.1.4.1.2021.991'
+snmpFields = ['target', 'mode', 'state', 'rtt', 'tag', 'count', 'name']
+# Members named in the message of an aggregated event, at most
+stormListed = 20
+# Supported check modes
+modes = ['icmp', 'dns', 'tcp', 'http']
+# Record types of the DNS checks
+dnsRecords = ['A', 'AAAA', 'SOA', 'NS', 'CNAME']
+# Priority classes of the checks, most important first
+priorities = ['critical', 'normal', 'low']
+# Settings a probe can override, the others come from the command line
+probeKeys = ['name', 'host', 'mode', 'source', 'dns', 'timeout', 'interval',
+             'dampening', 'tag', 'threshold', 'group', 'parent', 'burst',
+             'spacing', 'loss', 'port', 'banner', 'status', 'insecure',
+             'record', 'expect', 'race', 'confirm', 'backoff', 'priority']
+# Cisco IP SLA defaults: timeout and threshold in msec, frequency in sec
+ipslaDefaults = {'timeout': 5000, 'threshold': 5000, 'frequency': 60}
+# Stack size of the check worker threads, kept small to fit many on a switch
+workerStackSize = 256 * 1024
+# Name resolution of the ICMP and TCP targets: worker threads, and seconds
+# for which an address, or a failure, is cached
+resolverWorkers = 4
+resolveTtl = 300
+resolveNegativeTtl = 60
+# Receive buffer of the shared ICMP sockets, in bytes
+icmpBufferSize = 16 * 1024 * 1024
+# Linux SO_RCVBUFFORCE, not exposed by the socket module of older Pythons
+soRcvBufForce = getattr(socket, 'SO_RCVBUFFORCE',
+                        33 if platform.system() == 'Linux' else None)
+# Linux SO_TIMESTAMPNS: the kernel stamps each received packet (realtime
+# clock), and the layout of the struct timespec of the stamp
+soTimestampNs = getattr(socket, 'SO_TIMESTAMPNS',
+                        35 if platform.system() == 'Linux' else None)
+timespec = struct.Struct('@ll')
+# Highest resolution clock available to time and schedule the probes
+# (monotonic on Python 3)
+timer = getattr(time, 'perf_counter', time.time)
+# Amount of RTTs kept per target, and the memory budget of a target object
+# and its check, in bytes as measured by CPython 3 on 64 bits (see
+# Target.footprint()): Python 2 objects are larger
+rttHistory = 16
+targetBudget = 300
+# Window of the RTT percentiles, in seconds (0 disables them), and layout of
+# their histogram: 4 buckets per power of 2 of usec, from 2^4 to 2^24 usec
+percentileWindow = 300
+sketchSubBuckets = 4
+sketchMinExponent = 4
+sketchZeros = array.array('H', [0]) * (20 * sketchSubBuckets)
+# Smoothing of the RFC 3550 interarrival jitter estimate of ICMP bursts
+jitterGain = 1 / 16.0
+# Smallest batch of check results worth a vectorized dampening evaluation
+vectorizeMinimum = 32
+# Resolution of the scheduler, in seconds
+wheelResolution = 0.01
+# A target whose parent is down is checked once every so many intervals (0
+# never)
+unreachableEvery = 10
+# Depth of the rate limiter buckets, in seconds of their rate, and the part of
+# it reserved to the checks of the priorities over 'low'
+rateDepth = 0.1
+lowReserve = 0.5
+# eAPI of the local switch, read for --throttle (http or https method)
+eapiUsername = 'admin'
+eapiPassword = ''
+eapiEnablePassword = ''
+eapiMethod = 'http'
+# How often the CPU and CoPP counters are read (seconds)
+eapiPollInterval = 10
+# Throttling: CPU usage under which the control plane is calm again, as a
+# fraction of the --throttle one, and the smallest fraction of the probe rate
+throttleCalm = 0.75
+throttleFloor = 1 / 16.0
+# Checks, at the throttled cadence, for which the death of a target failing
+# while throttled is withheld, at most
+throttleHold = 3
 
 def setLogging(args):
     # The log level sets the amount of information displayed (error<info<debug)
@@ -199,14 +585,15 @@ def parseArgs():
     parser.add_argument('-V', '--veryverbose', action='store_true',
                         help='activates very verbose output')
 
-    parser.add_argument('-i', '--interval', type=int, default=5,
+    parser.add_argument('-i', '--interval', type=float, default=5,
                         help='Interval of polls. Default is 5')
 
-    parser.add_argument('-t', '--timeout', type=int, default=5,
+    parser.add_argument('-t', '--timeout', type=float, default=5,
                         help='Amount of seconds to wait for a response')
 
-    parser.add_argument('-m', '--mode', default='icmp',
-                        help='detection mode: ICMP, DNS or SSH. \
+    parser.add_argument('-m', '--mode', default='icmp', type=str.lower,
+                        choices=modes,
+                        help='detection mode: ICMP, DNS, TCP or HTTP. \
                                 Default is ICMP')
 
     parser.add_argument('-s', '--source',
@@ -214,17 +601,217 @@ def parseArgs():
 
     parser.add_argument('-d', '--dns',
                         help='IP address of the DNS name-server, to be used in\
-                                conjunction with the DNS mode and a FQDN')
+                                conjunction with the DNS mode and a FQDN. \
+                                Several comma separated name-servers are \
+                                queried at once')
+
+    parser.add_argument('--race', action='store_true',
+                        help='with several name-servers, the first valid \
+                                answer completes the DNS check')
+
+    parser.add_argument('-r', '--record', default='A', type=str.upper,
+                        choices=dnsRecords,
+                        help='record type queried in the DNS mode. Default \
+                                is A')
+
+    parser.add_argument('-e', '--expect',
+                        help='comma separated answers expected in the DNS \
+                                mode, any other degrades the target')
+
+    parser.add_argument('-p', '--port', type=int, default=22,
+                        help='TCP port connected to in the TCP mode. Default \
+                                is 22 (SSH)')
+
+    parser.add_argument('--banner',
+                        help='regular expression the first line sent by the \
+                                server must match in the TCP mode, e.g. ^SSH-')
+
+    parser.add_argument('--status', default='[23]',
+                        help='regular expression the HTTP status code must \
+                                match in the HTTP mode. Default is [23]')
+
+    parser.add_argument('--insecure', action='store_true',
+                        help='does not verify the certificates of the HTTPS \
+                                servers')
 
     parser.add_argument('-D', '--dampening', type=int, default=3,
                         help='Dampening amount of fail/success for target to\
                                 be considered switching status')
 
-    parser.add_argument('host', nargs='+',
+    parser.add_argument('-T', '--threshold', type=float,
+                        help='RTT threshold in ms over which a responding \
+                                target is degraded. Default is none')
+
+    parser.add_argument('--confirm', type=float, metavar='SEC',
+                        help='interval of the checks confirming a failure \
+                                (or a recovery). Default is none, the \
+                                interval')
+
+    parser.add_argument('--backoff', type=float, metavar='SEC',
+                        help='longest interval of the checks of a dead \
+                                target, doubling from the interval with each \
+                                failure. Default is none, the interval')
+
+    parser.add_argument('--priority', choices=priorities,
+                        help='priority class of the checks under the rate \
+                                limit. Default is normal')
+
+    parser.add_argument('--max-pps', type=float, metavar='PPS',
+                        help='packets per second sent by all the checks, at \
+                                most. Default is none')
+
+    parser.add_argument('--max-bytes', type=float, metavar='BYTES',
+                        help='bytes per second sent by all the checks, at \
+                                most. Default is none')
+
+    parser.add_argument('--throttle', type=float, metavar='PERCENT',
+                        help='CPU usage of the switch over which the checks \
+                                slow down, as do they on CoPP drops (EOS \
+                                eAPI). Default is none')
+
+    parser.add_argument('--parent', metavar='NAME',
+                        help='name of the target the others depend on, e.g. \
+                                their gateway. Default is none')
+
+    parser.add_argument('--unreachable-every', type=int,
+                        default=unreachableEvery, metavar='COUNT',
+                        help='intervals between the checks of a target \
+                                whose parent is down (0 never). Default is 10')
+
+    parser.add_argument('-b', '--burst', type=int, default=1,
+                        help='Amount of ICMP echos sent per check. Default \
+                                is 1')
+
+    parser.add_argument('--spacing', type=float, default=20,
+                        help='Time in ms between the echos of a burst. \
+                                Default is 20')
+
+    parser.add_argument('-L', '--loss', type=float, default=50,
+                        help='Loss in percent up to which a burst is a \
+                                success. Default is 50')
+
+    parser.add_argument('-w', '--workers', type=int, default=64,
+                        help='Amount of checks running concurrently when \
+                                monitoring several hosts. Default is 64')
+
+    parser.add_argument('-H', '--history', type=int, default=rttHistory,
+                        help='Amount of RTTs kept per target. Default is 16')
+
+    parser.add_argument('-P', '--percentiles', type=float,
+                        default=percentileWindow, metavar='WINDOW',
+                        help='Window of the RTT percentiles in seconds, 0 to \
+                                disable them. Default is 300')
+
+    parser.add_argument('-I', '--ipsla', metavar='FILE',
+                        help='Cisco configuration whose IP SLA monitors are \
+                                compiled into probes to check')
+
+    parser.add_argument('-c', '--config', metavar='FILE',
+                        help='inventory of probes to check (JSON or YAML), \
+                                reloaded on SIGHUP')
+
+    parser.add_argument('-n', '--notify', action='append', metavar='SINK',
+                        help='where the notifications are sent: syslog (local, \
+                                the default), udp://host[:port] or \
+                                tcp://host[:port] (remote RFC 5424 syslog), \
+                                snmp://[community@]host[:port] (SNMPv2c \
+                                traps) or json:FILE. Can be repeated')
+
+    parser.add_argument('--queue', type=int, default=noticeQueueSize,
+                        help='notifications waiting to be sent, at most. \
+                                Default is 10000')
+
+    parser.add_argument('--drop', choices=['newest', 'oldest'],
+                        default='newest',
+                        help='notifications dropped when the queue is full. \
+                                Default is newest')
+
+    parser.add_argument('-C', '--correlate', type=float, default=0,
+                        metavar='SEC',
+                        help='window (s) over which the changes of state of \
+                                a same group are notified as one event. \
+                                Default is 0, no correlation')
+
+    parser.add_argument('--correlate-by', choices=['prefix', 'source', 'tag'],
+                        default='prefix',
+                        help='groups of the correlated changes of state: \
+                                /24 or /64 prefix, source or tag. Default is \
+                                prefix')
+
+    parser.add_argument('--flap', type=int, default=0, metavar='COUNT',
+                        help='notifications per target and --flap-period, \
+                                at most. Default is 0, no limit')
+
+    parser.add_argument('--flap-period', type=float, default=600,
+                        metavar='SEC',
+                        help='period (s) of the --flap limit. Default is 600')
+
+    parser.add_argument('--state', metavar='FILE',
+                        help='file the dampening state is saved in, and \
+                                restored from on start. Default is none')
+
+    parser.add_argument('--state-interval', type=float, default=60,
+                        metavar='SEC',
+                        help='period (s) of the --state saves. Default is 60')
+
+    parser.add_argument('--trap-receiver', metavar='[HOST:]PORT',
+                        help='prints the SNMP traps received, e.g. to test \
+                                the snmp:// notifications, then exits')
+
+    parser.add_argument('--show-plan', action='store_true',
+                        help='displays the probe plan compiled from the IP \
+                                SLA configuration, then exits')
+
+    parser.add_argument('host', nargs='*',
                         help='FQDN or IP address of the destination(s) to \
                                 check')
 
     args = parser.parse_args()
+    if args.percentiles < 0:
+        parser.error('the percentile window cannot be negative')
+    if args.history < 1:
+        parser.error('the RTT history must hold at least 1 sample')
+    if not args.host and not args.ipsla and not args.config and \
+            not args.trap_receiver:
+        parser.error('a host, an IP SLA configuration (-I) or an inventory \
+(-c) is required')
+    if args.show_plan and not args.ipsla:
+        parser.error('--show-plan requires an IP SLA configuration (-I)')
+    if args.interval <= 0:
+        parser.error('the interval must be greater than 0')
+    if (args.confirm is not None and args.confirm <= 0) or \
+            (args.backoff is not None and args.backoff <= 0):
+        parser.error('--confirm and --backoff must be greater than 0')
+    if (args.max_pps is not None and args.max_pps <= 0) or \
+            (args.max_bytes is not None and args.max_bytes <= 0):
+        parser.error('--max-pps and --max-bytes must be greater than 0')
+    if args.throttle is not None and not 0 < args.throttle <= 100:
+        parser.error('the --throttle CPU usage must be between 0 and 100')
+    if args.throttle and jsonrpclib is None:
+        parser.error('--throttle requires jsonrpclib (pip install jsonrpclib)')
+    if args.unreachable_every < 0:
+        parser.error('--unreachable-every cannot be negative')
+    if args.burst < 1:
+        parser.error('a burst must hold at least 1 echo')
+    if args.spacing < 0:
+        parser.error('the burst spacing cannot be negative')
+    if not 0 < args.port < 0x10000:
+        parser.error('the TCP port must be between 1 and 65535')
+    if args.mode == 'dns' and args.host and not args.dns:
+        parser.error('the DNS mode requires a name-server (-d)')
+    if args.queue < 1:
+        parser.error('the notification queue must hold at least 1 message')
+    if args.correlate < 0:
+        parser.error('the correlation window cannot be negative')
+    if args.flap < 0 or args.flap_period <= 0:
+        parser.error('the flap limit cannot be negative, nor its period null')
+    if args.state_interval <= 0:
+        parser.error('--state-interval must be greater than 0')
+    args.notify = args.notify or ['syslog']
+    for sink in args.notify:
+        if sink != 'syslog' and not re.match(r'(udp|tcp|snmp)://.|json:.',
+                                             sink):
+            parser.error('unsupported notification sink {}'.format(sink))
     if args.veryverbose:
         args.verbose = True
 
@@ -243,8 +830,45 @@ def argsDisplay(args):
     logging.info(logStr.format('Mode:', args.mode))
     logging.info(logStr.format('Source IP:', args.source))
     logging.info(logStr.format('DNS server:', args.dns))
+    logging.info(logStr.format('DNS race:', args.race))
+    logging.info(logStr.format('DNS record type:', args.record))
+    logging.info(logStr.format('Expected answers:', args.expect))
+    logging.info(logStr.format('TCP port:', args.port))
+    logging.info(logStr.format('Banner:', args.banner))
+    logging.info(logStr.format('HTTP status:', args.status))
+    logging.info(logStr.format('Insecure HTTPS:', args.insecure))
     logging.info(logStr.format('Dampening amount:', args.dampening))
+    logging.info(logStr.format('RTT threshold:', args.threshold))
+    logging.info(logStr.format('Cadence:', 'confirmation every {} s, '
+                               'backoff up to {} s'.format(args.confirm,
+                                                          args.backoff)))
+    logging.info(logStr.format('Rate limit:', '{} packets/s, {} bytes/s, '
+                               'priority {}'.format(args.max_pps,
+                                                    args.max_bytes,
+                                                    args.priority or 'normal')))
+    logging.info(logStr.format('Throttle:', 'over {}% CPU or CoPP drops'
+                               .format(args.throttle)))
+    logging.info(logStr.format('Parent:', '{}, children checked every {} '
+                               'intervals when it is down'.format(
+                                   args.parent, args.unreachable_every)))
+    logging.info(logStr.format('Burst:', '{} echos every {} ms, up to {}% '
+                               'loss'.format(args.burst, args.spacing,
+                                             args.loss)))
+    logging.info(logStr.format('Workers:', args.workers))
+    logging.info(logStr.format('RTT history:', args.history))
+    logging.info(logStr.format('Percentile window:', args.percentiles))
     logging.info(logStr.format('Target Host:', args.host))
+    logging.info(logStr.format('IP SLA configuration:', args.ipsla))
+    logging.info(logStr.format('Inventory:', args.config))
+    logging.info(logStr.format('Notifications:', ', '.join(args.notify)))
+    logging.info(logStr.format('Notification queue:', '{}, dropping the {}'
+                               .format(args.queue, args.drop)))
+    logging.info(logStr.format('Correlation:', '{} s by {}'.format(
+        args.correlate, args.correlate_by)))
+    logging.info(logStr.format('Flap limit:', '{} per {} s'.format(
+        args.flap, args.flap_period)))
+    logging.info(logStr.format('State file:', '{}, saved every {} s'.format(
+        args.state, args.state_interval)))
     logging.info('#######################################')
     logging.info('')
 
@@ -274,100 +898,498 @@ def checkOS():
     return osSettings
     
 
-'''
-# For potential SSH connectivity testing
-def checkSocket(ip, port, timeout):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.settimeout(timeout)
-    try:
-        s.connect((ip, port))
-        logging.error("{} - Port {} is reachable".format(ip, port))
-        test_success = True
-    except socket.error as e:
-        logging.error("Error on connect: {}".format(e))
-        test_success = False
-    s.settimeout(None)
-    #fileobj = s.makefile('rb', 0)
-    s.close()
-    return(test_success)
-'''
 
+class CheckDNS(object):
+    # Verify that a host resolves via a specified DNS server, returns the
+    # answers of the record type queried. The query is built once, the
+    # DnsEngine only changes its ID. Answers outside the expected set, if
+    # any, are reported invalid (e.g. a hijacked or stale record). 'status'
+    # is the outcome of the last query: its rcode, or TIMEOUT, NODATA or
+    # MISMATCH; with several name-servers, those of the servers in error.
+    # The settings, shared by the targets using the same ones, are
+    # (name-servers, source, timeout, record type, expected answers, race).
+    __slots__ = ('target', 'options', 'message', 'wire', 'status')
+    shared = {}
 
-class CheckDNS:
-    # Verify that a host resolves via a specified DNS server, returns the IP
-    def __init__(self, dnsServer, source, target):
-        self.dnsServer = dnsServer
-        self.source = source
+    def __init__(self, dnsServer, source, target, timeout, record=None,
+                 expect=None, race=False):
         self.target = target
+        if expect is not None:
+            if not isinstance(expect, (list, tuple)):
+                expect = str(expect).split(',')
+            expect = frozenset(value.strip().lower() for value in expect)
+        options = (tuple(nameServers(dnsServer).split(',')), source, timeout,
+                   (record or 'A').upper(), expect, bool(race))
+        self.options = CheckDNS.shared.setdefault(options, options)
+        self.message = None
+        self.wire = None
+        self.status = None
+
+    def query(self):
+        if self.message is None:
+            queryType = self.options[3]
+            self.message = dns.message.make_query(self.target, queryType)
+            self.wire = self.message.to_wire()
+        return self.message
+
+    def queryWire(self, queryId):
+        self.query()
+        return struct.pack('!H', queryId) + self.wire[2:]
+
+    def isResponse(self, response):
+        return response.flags & dns.flags.QR and \
+            response.question == self.message.question
 
     def isAlive(self):
-        results = self.resolve()
-        ip = ''
-        if results:
-            # There might be multiple IP address but the 1st suffice
-            ip = results[0]
-            result = True
-        else:
-            result = False
-        return result, ip
-
-    def resolve(self):
-        queryType = 'A'
-        results = ''
-        resolver = dns.resolver.Resolver(configure=False)
-        resolver.nameservers = [self.dnsServer]
-        resolver.timeout = args.timeout
-        resolver.lifetime = args.timeout
+        # Blocking check of the first name-server, the DnsEngine pipelines
+        # the same query to all of them instead
+        dnsServers, source, timeout = self.options[:3]
+        dnsServer = dnsServers[0]
         try:
             logging.debug(logStr.format('Info:', 'DNS query attempt'))
-            results = resolver.query(self.target, queryType,
-                                     source=self.source)
-        except dns.resolver.NoAnswer:
-            logging.info('No response to the DNS query')
-            pass
-        except dns.resolver.NXDOMAIN:
-            logging.info('DNS query name does no exist')
-            pass
+            sent = timer()
+            response = dns.query.udp(self.query(), dnsServer,
+                                     timeout=timeout, source=source)
         except dns.exception.Timeout:
             logging.info('The DNS query timed out')
-            pass
+            self.status = 'TIMEOUT'
+            return False, ''
+        logging.debug(logStr.format('DNS reply:', '{:.3f} ms'.format(
+            (timer() - sent) * 1000)))
+        return self.evaluate(response)[:2]
+
+    def answers(self, response):
+        # Answers of the record type queried, as text: addresses, names, or
+        # the serial of an SOA
+        rdtype = dns.rdatatype.from_text(self.options[3])
+        values = []
+        for rrset in response.answer:
+            if rrset.rdtype != rdtype:
+                continue
+            for rr in rrset:
+                if rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+                    values.append(rr.address.lower())
+                elif rdtype == dns.rdatatype.SOA:
+                    values.append(str(rr.serial))
+                else:
+                    values.append(rr.target.to_text().lower())
+        return values
+
+    def evaluate(self, response):
+        # (alive, answers, valid) of a response
+        results = self.answers(response)
         for result in results:
-            # Debugging - list all the IP addresses resolved
-            logging.debug(logStr.format('Result DNS IP address:', result.address))
-        return results
+            # Debugging - list all the answers
+            logging.debug(logStr.format('Result DNS answer:', result))
+        expect = self.options[4]
+        if results:
+            self.status = 'NOERROR'
+            valid = expect is None or expect.issuperset(results)
+            if not valid:
+                self.status = 'MISMATCH'
+                logging.info(logStr.format('Unexpected DNS answer:', '{} ({})'
+                                           .format(', '.join(results),
+                                                   self.target)))
+            return True, ', '.join(results), valid
+        rcode = response.rcode()
+        self.status = dns.rcode.to_text(rcode)
+        if rcode == dns.rcode.NXDOMAIN:
+            logging.info('DNS query name does no exist')
+        elif rcode == dns.rcode.NOERROR:
+            self.status = 'NODATA'
+            logging.info(logStr.format('No answer to the DNS query:',
+                                       self.options[3]))
+        elif rcode == dns.rcode.SERVFAIL:
+            logging.info(logStr.format('The DNS server failed:', self.target))
+        elif rcode == dns.rcode.REFUSED:
+            logging.info(logStr.format('The DNS server refused:', self.target))
+        else:
+            logging.info(logStr.format('The DNS query failed:', self.status))
+        return False, '', True
+
+
+class CheckTCP(object):
+    # Verifies that a TCP port accepts connections and, optionally, that the
+    # first line sent by the server (e.g. an SSH greeting) matches a regular
+    # expression. The TcpEngine runs the same check without blocking.
+    __slots__ = ('host', 'source', 'port', 'banner', 'timeout')
+
+    def __init__(self, host, source, port, banner, timeout):
+        self.host = host
+        self.source = source
+        self.port = int(port)
+        self.banner = banner
+        self.timeout = timeout
+
+    def connection(self, ip):
+        # Non-blocking socket whose close() resets the connection, leaving
+        # no TIME_WAIT behind however many targets are checked
+        family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER,
+                        struct.pack('ii', 1, 0))
+        if self.source:
+            sock.bind((self.source, 0))
+        sock.setblocking(False)
+        return sock
+
+    def isAlive(self):
+        # Blocking check, the TcpEngine multiplexes the same connections
+        ip = socket.gethostbyname(self.host)
+        sock = self.connection(ip)
+        sock.settimeout(self.timeout)
+        try:
+            sent = timer()
+            sock.connect((ip, self.port))
+            latency = round((timer() - sent) * 1000, 3)
+            if not self.banner:
+                return True, latency
+            return self.evaluate(sock.recv(512))[0], latency
+        except socket.error as e:
+            logging.info(logStr.format('The TCP check did not succeed:', e))
+            return False, ''
+        finally:
+            sock.close()
+
+    def evaluate(self, data):
+        # (match, first line) of the data received from the server
+        line = data.split(b'\n')[0].strip().decode('ascii', 'replace')
+        if re.match(self.banner, line):
+            return True, line
+        logging.info(logStr.format('Unexpected banner:', line))
+        return False, line
+
+
+class HttpsConnection(httplib.HTTPSConnection):
+    # HTTPS connection resuming the TLS session last negotiated with its
+    # server by any target, so that reconnecting does not cost a full
+    # handshake (Python 3.6 and later)
+    tlsContext = None
+
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        key = (self.host, self.port)
+        options = {}
+        session = CheckHTTP.sessions.get(key)
+        if session is not None:
+            options['session'] = session
+        self.sock = self.tlsContext.wrap_socket(
+            self.sock, server_hostname=self.host, **options)
+        if session is not None:
+            logging.debug(logStr.format('TLS session resumed:', '{} ({})'.format(
+                self.sock.session_reused, self.host)))
+
+    def remember(self):
+        # TLS 1.3 session tickets arrive after the handshake, the session is
+        # kept once a response was read
+        session = getattr(self.sock, 'session', None)
+        if session is not None:
+            CheckHTTP.sessions[(self.host, self.port)] = session
+
+
+class CheckHTTP(object):
+    # Verifies that a URL answers with an expected status code. The
+    # connection is kept alive from one check to the next; TLS contexts
+    # and sessions are shared by all the targets. The response is the total
+    # time (ms), the status and time to first byte are kept in 'last'.
+    # Checks run in the worker pool, one at a time per target.
+    __slots__ = ('url', 'timeout', 'options', 'connection', 'last')
+    # Settings shared by the targets, TLS contexts by verification, and last
+    # TLS session by server
+    shared = {}
+    contexts = {}
+    sessions = {}
+
+    def __init__(self, url, source, timeout, status, insecure):
+        if '://' not in url:
+            url = 'http://' + url
+        self.url = url
+        self.timeout = timeout
+        options = (source, status, bool(insecure))
+        self.options = CheckHTTP.shared.setdefault(options, options)
+        self.connection = None
+        self.last = None
+
+    def connect(self):
+        source, status, insecure = self.options
+        parts = urlsplit(self.url)
+        options = {'timeout': self.timeout}
+        if source:
+            options['source_address'] = (source, 0)
+        if parts.scheme != 'https':
+            return httplib.HTTPConnection(parts.hostname, parts.port,
+                                          **options)
+        context = CheckHTTP.contexts.get(insecure)
+        if context is None:
+            context = ssl.create_default_context()
+            if insecure:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            CheckHTTP.contexts[insecure] = context
+        connection = HttpsConnection(parts.hostname, parts.port,
+                                     context=context, **options)
+        connection.tlsContext = context
+        return connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def isAlive(self):
+        parts = urlsplit(self.url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        # A kept-alive connection may have been closed by the server in
+        # between, it is then retried once on a new connection
+        for attempt in range(2):
+            reused = self.connection is not None
+            if not reused:
+                self.connection = self.connect()
+            try:
+                start = timer()
+                self.connection.request('GET', path, headers={
+                    'User-Agent': 'does_it_live'})
+                response = self.connection.getresponse()
+                firstByte = timer()
+                response.read()
+                end = timer()
+            except (socket.error, ssl.SSLError, httplib.HTTPException) as e:
+                self.close()
+                if reused:
+                    continue
+                logging.info(logStr.format('The HTTP check did not succeed:',
+                                           '{} ({})'.format(e, self.url)))
+                self.last = None
+                return False, ''
+            break
+        if isinstance(self.connection, HttpsConnection):
+            self.connection.remember()
+        if response.will_close:
+            self.close()
+        firstByte = round((firstByte - start) * 1000, 3)
+        self.last = (response.status, firstByte)
+        logging.info(logStr.format('HTTP response:', '{} {}, first byte in '
+                                   '{:.3f} ms ({})'.format(response.status,
+                                                           response.reason,
+                                                           firstByte,
+                                                           self.url)))
+        if not re.match(self.options[1], str(response.status)):
+            logging.info(logStr.format('Unexpected HTTP status:',
+                                       response.status))
+            return False, ''
+        return True, round((end - start) * 1000, 3)
+
+    def summary(self):
+        if self.last is None:
+            return {'status': None, 'firstByte': None}
+        return {'status': self.last[0], 'firstByte': self.last[1]}
+
+
+def checksum(data):
+    # Internet checksum (RFC 1071) of an ICMP header and payload
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+class IcmpSocket():
+    # Native ICMP echo socket, avoiding a fork/exec of 'ping' per probe.
+    # A raw socket is used when privileged (EOS runs scripts as root),
+    # otherwise the unprivileged Linux datagram ICMP socket
+    # (see sysctl net.ipv4.ping_group_range).
+    # Replies carry their kernel receive timestamp when the socket supports
+    # SO_TIMESTAMPNS and Python has recvmsg() (Python 3), so that the time
+    # they waited for this process is not counted in their RTT.
+    idents = itertools.count(os.getpid())
+
+    def __init__(self, source=None):
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                      socket.IPPROTO_ICMP)
+            self.raw = True
+        except socket.error:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                                      socket.IPPROTO_ICMP)
+            self.raw = False
+        if source or not self.raw:
+            self.sock.bind((source or '', 0))
+        self.sock.setblocking(False)
+        if self.raw:
+            self.ident = next(IcmpSocket.idents) & 0xffff
+        else:
+            # The kernel rewrites the identifier with the socket 'port'
+            self.ident = self.sock.getsockname()[1]
+        self.seq = 0
+        self.stamped = False
+        if soTimestampNs is not None and hasattr(self.sock, 'recvmsg'):
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, soTimestampNs, 1)
+                self.stamped = True
+            except socket.error:
+                pass
 
+    def fileno(self):
+        return self.sock.fileno()
 
-class checkICMP:
+    def close(self):
+        self.sock.close()
+
+    def nextKey(self, inflight):
+        # Next (identifier, sequence) not already waiting for a reply. Raw
+        # sockets pick a new identifier when the sequence wraps around.
+        # Stops at the first free key, not building a range on Python 2
+        tries = 0
+        while tries < 0x10000:
+            tries += 1
+            self.seq = (self.seq + 1) & 0xffff
+            if self.seq == 0 and self.raw:
+                self.ident = next(IcmpSocket.idents) & 0xffff
+            key = (self.ident, self.seq)
+            if key not in inflight:
+                return key
+        raise socket.error(errno.ENOBUFS, 'ICMP in-flight table is full')
+
+    def send(self, ip, seq, ident=None, payload=b'does_it_live'):
+        if ident is None:
+            ident = self.ident
+        header = struct.pack('!BBHHH', 8, 0, 0, ident, seq)
+        header = struct.pack('!BBHHH', 8, 0, checksum(header + payload),
+                             ident, seq)
+        self.sock.sendto(header + payload, (ip, 0))
+
+    def receive(self):
+        # Returns (identifier, sequence, source IP@) of an echo reply or None
+        try:
+            data, address = self.sock.recvfrom(2048)
+        except socket.error:
+            return None
+        return self.parse(data, address)
+
+    def drain(self, limit=1024):
+        # Yields (identifier, sequence, source IP@, receive time, correction)
+        # for each echo reply queued on the socket, until it would block. The
+        # receive time is on the timer() clock, moved back by the correction
+        # (seconds) to when the kernel received the reply, if stamped.
+        for i in range(limit):
+            try:
+                if self.stamped:
+                    data, ancillary, flags, address = self.sock.recvmsg(
+                        2048, socket.CMSG_SPACE(timespec.size))
+                else:
+                    data, address = self.sock.recvfrom(2048)
+            except socket.error:
+                return
+            received = timer()
+            correction = 0.0
+            if self.stamped:
+                correction = self.correction(ancillary)
+            reply = self.parse(data, address)
+            if reply:
+                yield reply + (received - correction, correction)
+
+    def correction(self, ancillary):
+        # Time elapsed since the kernel stamp, 0 without a sensible stamp
+        # (e.g. the realtime clock was stepped)
+        for level, kind, value in ancillary:
+            if level == socket.SOL_SOCKET and kind == soTimestampNs and \
+                    len(value) >= timespec.size:
+                seconds, nanoseconds = timespec.unpack_from(value)
+                elapsed = time.time() - seconds - nanoseconds / 1e9
+                if 0 <= elapsed < 1:
+                    return elapsed
+        return 0.0
+
+    def parse(self, data, address):
+        if self.raw:
+            # Raw sockets also deliver the IP header
+            data = data[(bytearray(data[:1])[0] & 0x0f) * 4:]
+        if len(data) < 8:
+            return None
+        icmpType, code, _, ident, seq = struct.unpack('!BBHHH', data[:8])
+        if icmpType != 0:
+            return None
+        return ident, seq, address[0]
+
+
+class checkICMP(object):
     # Verifies a reachability by ICMP and records the response latency
-    def __init__(self, osSettings, host):
-        
+    __slots__ = ('timeUnit', 'sourceSetting', 'host', 'source', 'timeout')
+    # None until the first probe tells whether ICMP sockets can be opened
+    native = None
+
+    def __init__(self, osSettings, host, source, timeout):
         self.timeUnit = osSettings['timeUnit']
         self.sourceSetting = osSettings['sourceSetting']
         self.host = host
+        self.source = source
+        self.timeout = timeout
 
     def getLatency(self, output):
-        # Must first get an output to parse, used after/with isAlive()
+        # Must first get an output to parse, used after/with ping()
         outputLines = output.split('\n')
         lastNonEmpty = [i for i in outputLines if i][-1]
         logging.debug(logStr.format('Ping result:', lastNonEmpty))
         timingData = lastNonEmpty.split('=')[1]
         timingStats = timingData.split('/')
         pingAvg = timingStats[1]
-        return pingAvg + ' ms'
+        return float(pingAvg)
 
     def isAlive(self):
+        # Latency is returned in ms, with a microsecond resolution
+        if checkICMP.native is not False:
+            try:
+                sock = IcmpSocket(self.source)
+                checkICMP.native = True
+            except socket.error as e:
+                if checkICMP.native or \
+                        e.errno not in (errno.EPERM, errno.EACCES):
+                    raise
+                logging.info(logStr.format('Native ICMP unavailable:', e))
+                logging.info('Falling back to the ping command')
+                checkICMP.native = False
+            else:
+                try:
+                    return self.echo(sock)
+                finally:
+                    sock.close()
+        return self.ping()
+
+    def echo(self, sock):
+        ip = socket.gethostbyname(self.host)
+        seq = 1
+        sent = timer()
+        sock.send(ip, seq)
+        deadline = sent + self.timeout
+        remaining = self.timeout
+        while remaining > 0:
+            if not select.select([sock], [], [], remaining)[0]:
+                break
+            if sock.receive() == (sock.ident, seq, ip):
+                return True, round((timer() - sent) * 1000, 3)
+            remaining = deadline - timer()
+        logging.info('The ICMP check did not succeed')
+        return False, 0
+
+    def ping(self):
         result = ''
         output = ''
         latency = 0
         pythonVersion = sys.version_info[0]
         logging.debug(logStr.format('Python version:', pythonVersion))
 
-        src_exists = True if args.source else False
+        # ping only takes whole seconds
+        timeout = int(math.ceil(self.timeout)) * self.timeUnit
+        src_exists = True if self.source else False
         command = ['ping'] + \
                   ['-n'] + \
                   ['-c 1'] + \
-                  ['-W ' + str(args.timeout * self.timeUnit)] + \
-                  [self.sourceSetting + str(args.source)] * src_exists + \
+                  ['-W ' + str(timeout)] + \
+                  [self.sourceSetting + str(self.source)] * src_exists + \
                   [self.host]
         logging.debug(logStr.format('The command is:', str(command)))
 
@@ -408,83 +1430,3054 @@ class checkICMP:
 
 
 class Notice():
-    # Sends messages out by Syslog or potentially other future methods
+    # Sends messages out by Syslog or other sinks. Messages are queued, up
+    # to a bound, and a background thread sends them in batches to every
+    # sink, so that a slow or blocked sink never delays the checks: while it
+    # sends, the next messages accumulate into the next batch. When the queue
+    # is full the newest (or oldest) messages are dropped and counted.
+    # A message is queued with its time and fields (target, mode, state, RTT
+    # and tag of a change of state), for the sinks which use them.
+    def __init__(self, sinks=None, size=None, drop='newest'):
+        self.sinks = sinks if sinks is not None else [LocalSyslog()]
+        self.size = size or noticeQueueSize
+        self.drop = drop
+        self.queue = collections.deque()
+        self.ready = threading.Condition()
+        self.sending = 0
+        # Backpressure counters: messages sent to at least one sink, and to
+        # none, and the messages each sink failed to send
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.errors = {}
+        self.depth = 0
+        sender = threading.Thread(target=self.sender)
+        sender.daemon = True
+        sender.start()
+
+    def syslog(self, msg, fields=None):
+        with self.ready:
+            if len(self.queue) >= self.size:
+                self.dropped += 1
+                if self.drop == 'newest':
+                    return
+                self.queue.popleft()
+            self.queue.append((time.time(), msg, fields or {}))
+            self.queued += 1
+            self.depth = max(self.depth, len(self.queue))
+            self.ready.notify()
+
+    def sender(self):
+        while True:
+            with self.ready:
+                while not self.queue:
+                    self.ready.wait()
+                batch = [self.queue.popleft() for i in
+                         range(min(len(self.queue), noticeBatch))]
+                self.sending = len(batch)
+            reached = 0
+            for sink in self.sinks:
+                try:
+                    sink.send(batch)
+                    reached += 1
+                except Exception as e:
+                    # Any error of a sink, which must not end the thread
+                    logging.info(logStr.format('Notification failed:', '{} '
+                                               '({})'.format(e, sink.name)))
+                    with self.ready:
+                        self.errors[sink.name] = \
+                            self.errors.get(sink.name, 0) + len(batch)
+            with self.ready:
+                if reached:
+                    self.sent += len(batch)
+                else:
+                    self.failed += len(batch)
+                self.sending = 0
+                self.ready.notify_all()
+
+    def close(self, timeout):
+        # Waits for the queued messages to be sent, at most timeout seconds
+        deadline = time.time() + timeout
+        with self.ready:
+            while self.queue or self.sending:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                self.ready.wait(remaining)
+
+    def counters(self):
+        with self.ready:
+            return {'engine': 'notice', 'queued': self.queued,
+                    'sent': self.sent, 'dropped': self.dropped,
+                    'failed': self.failed, 'errors': dict(self.errors),
+                    'depth': len(self.queue), 'maxDepth': self.depth}
+
+
+def prefixOf(address):
+    # /24 of an IPv4 address, /64 of an IPv6 one, else the address (name)
+    for family, length, bits in ((socket.AF_INET, 4, 24),
+                                 (socket.AF_INET6, 16, 64)):
+        try:
+            packed = socket.inet_pton(family, address)
+        except (socket.error, ValueError, TypeError):
+            continue
+        masked = packed[:bits // 8] + b'\0' * (length - bits // 8)
+        return '{}/{}'.format(socket.inet_ntop(family, masked), bits)
+    return address
+
+
+class Correlator():
+    # Correlation of the changes of state, between the targets and the
+    # Notice. The changes to a same state of the targets of a same group
+    # (source, tag or prefix) within the window are held, then notified at
+    # once: those of several targets as one aggregated event with their
+    # count and names, e.g. when an upstream link dies. A target notified
+    # more than flapLimit times in a flapPeriod is muted until the end of
+    # the period, then its last change notified with the count of the muted
+    # ones. Without window nor flapLimit, the changes pass through.
+    # Changes undoing each state
+    opposites = {'dead': ('alive',), 'unreachable-via-parent': ('alive',),
+                 'alive': ('dead', 'unreachable-via-parent'),
+                 'degraded': ('normal',), 'normal': ('degraded',)}
+
+    def __init__(self, send, window=0, by='prefix', flapLimit=0,
+                 flapPeriod=600):
+        self.send = send
+        self.window = window
+        self.by = by
+        self.flapLimit = flapLimit
+        self.flapPeriod = flapPeriod
+        # (state, group) -> [deadline, [(msg, fields), ...]], and the group
+        # of each target held
+        self.pending = {}
+        self.held = {}
+        # Target name -> [start of period, notified, muted, last (msg,
+        # fields)], and those with muted changes
+        self.flaps = {}
+        self.muted = {}
+        self.pruneAt = timer() + flapPeriod
+        self.due = float('inf')
+        self.aggregated = 0
+        self.correlated = 0
+        self.suppressed = 0
+
+    def group(self, fields):
+        if self.by == 'source':
+            return fields.get('source') or 'default'
+        if self.by == 'tag':
+            return fields.get('tag') or 'untagged'
+        return prefixOf(fields.get('ip') or fields['target'])
+
+    def syslog(self, msg, fields=None):
+        if not fields:
+            self.send.syslog(msg, fields)
+            return
+        now = timer()
+        if self.flapLimit and self.flapping(msg, fields, now):
+            return
+        if not self.window:
+            self.send.syslog(msg, fields)
+            return
+        key = (fields['state'], self.group(fields))
+        entry = self.pending.get(key)
+        if entry is None:
+            entry = self.pending[key] = [now + self.window, []]
+            self.due = min(self.due, entry[0])
+        member = fields['name']
+        held = self.held.pop(member, None)
+        if held is not None:
+            # The change of a target within the window supersedes the one
+            # held, so that its last state is notified last, and undoes it
+            # if opposite (e.g. dead then alive): neither is notified
+            self.suppressed += 1
+            previous = self.pending[held]
+            previous[1][:] = [(heldMsg, heldFields)
+                              for heldMsg, heldFields in previous[1]
+                              if heldFields['name'] != member]
+            if not previous[1] and held != key:
+                del self.pending[held]
+            if fields['state'] in self.opposites.get(held[0], ()):
+                self.suppressed += 1
+                if not entry[1]:
+                    del self.pending[key]
+                return
+        self.held[member] = key
+        entry[1].append((msg, fields))
+
+    def flapping(self, msg, fields, now):
+        key = fields['name']
+        entry = self.flaps.get(key)
+        if entry is None or now - entry[0] >= self.flapPeriod:
+            entry = self.flaps[key] = [now, 0, 0, None]
+        entry[1] += 1
+        if entry[1] <= self.flapLimit:
+            return False
+        entry[2] += 1
+        entry[3] = (msg, fields)
+        self.suppressed += 1
+        if key not in self.muted:
+            logging.error(logStr.format('Warning:', 'Target {} is flapping, '
+                                        'muted'.format(fields['name'])))
+            self.muted[key] = entry
+            self.due = min(self.due, entry[0] + self.flapPeriod)
+        return True
+
+    def expire(self, now):
+        if now < self.due:
+            return
+        for key, entry in sorted(self.pending.items(),
+                                 key=lambda item: item[1][0]):
+            if entry[0] <= now:
+                del self.pending[key]
+                for msg, fields in entry[1]:
+                    del self.held[fields['name']]
+                self.notify(key, entry[1])
+        for key, entry in list(self.muted.items()):
+            if now - entry[0] >= self.flapPeriod:
+                del self.muted[key]
+                msg, fields = entry[3]
+                self.send.syslog('{} - flapping, {} change{} not notified'
+                                 .format(msg, entry[2],
+                                         's' if entry[2] > 1 else ''),
+                                 dict(fields, suppressed=entry[2]))
+        if now >= self.pruneAt:
+            for key, entry in list(self.flaps.items()):
+                if now - entry[0] >= self.flapPeriod:
+                    del self.flaps[key]
+            self.pruneAt = now + self.flapPeriod
+        deadlines = [entry[0] for entry in self.pending.values()]
+        deadlines.extend(entry[0] + self.flapPeriod
+                         for entry in self.muted.values())
+        if self.flaps:
+            deadlines.append(self.pruneAt)
+        self.due = min(deadlines) if deadlines else float('inf')
+
+    def nextDeadline(self):
+        return self.due if self.due != float('inf') else None
+
+    def notify(self, key, members):
+        if len(members) == 1:
+            self.send.syslog(*members[0])
+            return
+        state, group = key
+        self.aggregated += 1
+        self.correlated += len(members)
+        names = [fields['name'] for msg, fields in members]
+        modes = '/'.join(sorted(set(fields['mode'] for msg, fields in members)))
+        listed = ', '.join(names[:stormListed])
+        if len(names) > stormListed:
+            listed += ' and {} more'.format(len(names) - stormListed)
+        words = {'alive': 'back to life', 'normal': 'no longer degraded',
+                 'unreachable-via-parent': 'unreachable via their parent'}
+        logging.error(logStr.format('Warning:', '{} targets of {} {} are {}'
+                                    .format(len(names), self.by, group,
+                                            words.get(state, state))))
+        msg = '{} targets of {} {} are {} - {} check - {}'.format(
+            len(names), self.by, group, words.get(state, state), modes, listed)
+        self.send.syslog(msg, {'target': group, 'mode': modes, 'state': state,
+                               'rtt': None, 'count': len(names),
+                               'members': names,
+                               'tag': group if self.by == 'tag' else None})
+
+    def counters(self):
+        counters = self.send.counters()
+        counters.update(aggregated=self.aggregated, correlated=self.correlated,
+                        suppressed=self.suppressed)
+        return counters
+
+    def close(self, timeout):
+        # Notifies the held changes, and the last ones of the muted targets
+        self.flapPeriod = 0
+        self.due = 0
+        self.expire(float('inf'))
+        self.send.close(timeout)
+
+
+class LocalSyslog():
+    # Local syslog, opened once
+    name = 'syslog'
+
     def __init__(self):
+        syslog.openlog('does_it_live', 0, syslog.LOG_LOCAL4)
+
+    def send(self, batch):
+        for when, msg, fields in batch:
+            syslog.syslog(syslogPriority, syslogFormat + ': Log msg: %s' % msg)
+
+
+class RemoteSyslog():
+    # RFC 5424 syslog to a remote server, over UDP or over TCP (RFC 6587
+    # octet counting). The connection persists and is re-established once
+    # per batch on error.
+    def __init__(self, url):
+        self.name = url
+        parts = urlsplit(url)
+        self.transport = parts.scheme
+        self.address = (parts.hostname, parts.port or 514)
+        self.hostname = socket.gethostname()
+        self.sock = None
+
+    def connect(self):
+        if self.transport == 'tcp':
+            return socket.create_connection(self.address, 5)
+        family, kind, proto, name, address = socket.getaddrinfo(
+            self.address[0], self.address[1], 0, socket.SOCK_DGRAM)[0]
+        sock = socket.socket(family, kind, proto)
+        sock.connect(address)
+        return sock
+
+    def format(self, when, msg):
+        stamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(when))
+        frame = '<{}>1 {}.{:06d}Z {} does_it_live {} - - {}: Log msg: {}'.format(
+            syslogPriority, stamp, int(when % 1 * 1000000), self.hostname,
+            os.getpid(), syslogFormat, msg).encode('utf-8')
+        if self.transport == 'tcp':
+            frame = '{} '.format(len(frame)).encode('ascii') + frame
+        return frame
+
+    def send(self, batch):
+        frames = [self.format(when, msg) for when, msg, fields in batch]
+        for attempt in range(2):
+            try:
+                if self.sock is None:
+                    self.sock = self.connect()
+                if self.transport == 'tcp':
+                    self.sock.sendall(b''.join(frames))
+                else:
+                    for frame in frames:
+                        self.sock.send(frame)
+                return
+            except socket.error:
+                if self.sock is not None:
+                    self.sock.close()
+                    self.sock = None
+                if attempt:
+                    raise
+
+
+class JsonLines():
+    # JSON lines file, appended to, with the fields of the messages
+    def __init__(self, path):
+        self.name = path
+        self.file = open(path, 'a')
+
+    def send(self, batch):
+        self.file.write(''.join(json.dumps(dict(fields, time=round(when, 6),
+                                                message=msg),
+                                           sort_keys=True) + '\n'
+                                for when, msg, fields in batch))
+        self.file.flush()
+
+
+def berLength(length):
+    if length < 0x80:
+        return struct.pack('B', length)
+    if length < 0x100:
+        return struct.pack('BB', 0x81, length)
+    return struct.pack('!BH', 0x82, length)
+
+
+def berEncode(tag, content):
+    # BER type-length-value
+    return struct.pack('B', tag) + berLength(len(content)) + content
+
+
+def berInteger(value, tag=0x02):
+    # Shortest two's complement, also used by the unsigned SNMP types
+    # (Gauge32 0x42, TimeTicks 0x43)
+    data = bytearray()
+    while True:
+        data.insert(0, value & 0xff)
+        value >>= 8
+        if (value == 0 and not data[0] & 0x80) or \
+                (value == -1 and data[0] & 0x80):
+            break
+    return berEncode(tag, bytes(data))
+
+
+def berOid(oid):
+    parts = [int(part) for part in oid.strip('.').split('.')]
+    data = bytearray([parts[0] * 40 + parts[1]])
+    for part in parts[2:]:
+        chunk = [part & 0x7f]
+        part >>= 7
+        while part:
+            chunk.insert(0, 0x80 | (part & 0x7f))
+            part >>= 7
+        data.extend(chunk)
+    return berEncode(0x06, bytes(data))
+
+
+def berDecode(data):
+    # Values of the BER TLVs of data: integers, strings, dotted OIDs, and
+    # lists for the constructed types (SEQUENCE, PDUs)
+    data = bytearray(data)
+    values = []
+    offset = 0
+    while offset < len(data):
+        tag, length = data[offset], data[offset + 1]
+        offset += 2
+        if length & 0x80:
+            size = length & 0x7f
+            length = 0
+            for byte in data[offset:offset + size]:
+                length = length << 8 | byte
+            offset += size
+        content = data[offset:offset + length]
+        offset += length
+        if tag & 0x20:
+            values.append(berDecode(content))
+        elif tag in (0x02, 0x41, 0x42, 0x43):
+            value = 0
+            for byte in content:
+                value = value << 8 | byte
+            if tag == 0x02 and content and content[0] & 0x80:
+                value -= 1 << (8 * len(content))
+            values.append(value)
+        elif tag == 0x06:
+            parts = list(divmod(content[0], 40))
+            part = 0
+            for byte in content[1:]:
+                part = part << 7 | (byte & 0x7f)
+                if not byte & 0x80:
+                    parts.append(part)
+                    part = 0
+            values.append('.'.join(str(part) for part in parts))
+        else:
+            values.append(bytes(content).decode('utf-8', 'replace'))
+    return values
+
+
+class SnmpTrap():
+    # SNMPv2c traps (SNMPv2-Trap-PDU) of the changes of state, sent from one
+    # UDP socket. Everything but the request ID, uptime and field values is
+    # encoded once, in a template; the RTT is a Gauge32 in usec.
+    name = 'snmp'
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.name = url
+        self.start = timer()
+        self.requestIds = itertools.count(1)
+        family, kind, proto, name, address = socket.getaddrinfo(
+            parts.hostname, parts.port or 162, 0, socket.SOCK_DGRAM)[0]
+        self.sock = socket.socket(family, kind, proto)
+        self.sock.connect(address)
+        # Message header (version 1 is SNMPv2c) and community
+        self.header = berInteger(1) + berEncode(
+            0x04, (parts.username or 'public').encode('utf-8'))
+        self.uptimeOid = berOid('1.3.6.1.2.1.1.3.0')
+        self.trapVarbind = berEncode(0x30, berOid('1.3.6.1.6.3.1.1.4.1.0') +
+                                     berOid(snmpTrapOid + '.0.1'))
+        self.fieldOids = [berOid('{}.1.{}'.format(snmpTrapOid, index + 1))
+                          for index in range(len(snmpFields))]
+        self.errors = berInteger(0) + berInteger(0)
+
+    def encode(self, when, msg, fields):
+        uptime = int((timer() - self.start) * 100) & 0xffffffff
+        varbinds = [self.trapVarbind]
+        for oid, field in zip(self.fieldOids, snmpFields):
+            value = fields.get(field)
+            if field == 'rtt':
+                value = berInteger(int(value * 1000) if value else 0, 0x42)
+            elif field == 'count':
+                value = berInteger(value or 1, 0x42)
+            else:
+                value = berEncode(0x04, str(value or '').encode('utf-8'))
+            varbinds.append(berEncode(0x30, oid + value))
+        pdu = berEncode(0xa7, berInteger(
+            next(self.requestIds) & 0x7fffffff) + self.errors + berEncode(
+                0x30, berEncode(0x30, self.uptimeOid + berInteger(
+                    uptime, 0x43)) + b''.join(varbinds)))
+        return berEncode(0x30, self.header + pdu)
+
+    def send(self, batch):
+        for when, msg, fields in batch:
+            if fields:
+                self.sock.send(self.encode(when, msg, fields))
+
+
+def receiveTraps(address):
+    # Stand-in of an SNMP manager, e.g. for tests: prints the traps received
+    # as JSON lines, their varbinds of snmpFields by name
+    host, _, port = address.rpartition(':')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host or '127.0.0.1', int(port)))
+    names = dict(('{}.1.{}'.format(snmpTrapOid, index + 1), field)
+                 for index, field in enumerate(snmpFields))
+    logging.info(logStr.format('Receiving traps on:', sock.getsockname()))
+    while True:
+        data, sender = sock.recvfrom(65535)
+        try:
+            version, community, pdu = berDecode(data)[0]
+            requestId, status, index, varbinds = pdu
+            trap = {'from': sender[0], 'community': community,
+                    'uptime': varbinds[0][1], 'trap': varbinds[1][1]}
+            for oid, value in varbinds[2:]:
+                trap[names.get(oid, oid)] = value
+        except (IndexError, ValueError, TypeError):
+            logging.info(logStr.format('Invalid trap from:', sender[0]))
+            continue
+        print(json.dumps(trap, sort_keys=True))
+        sys.stdout.flush()
+
+
+def noticeSinks(specs):
+    # Sinks of the notifications: syslog, udp://..., tcp://..., snmp://...
+    # or json:FILE
+    sinks = []
+    for spec in specs:
+        if spec == 'syslog':
+            sinks.append(LocalSyslog())
+        elif spec.startswith('snmp://'):
+            sinks.append(SnmpTrap(spec))
+        elif spec.startswith('json:'):
+            sinks.append(JsonLines(spec[len('json:'):]))
+        else:
+            sinks.append(RemoteSyslog(spec))
+    return sinks
+
+
+def parseIpSla(text):
+    # Reads the 'ip sla monitor' entries of a Cisco configuration and returns
+    # a dictionary of monitor number -> settings
+    monitors = {}
+    current = None
+    for line in text.splitlines():
+        words = line.split()
+        if not words:
+            continue
+        if words[:3] == ['ip', 'sla', 'monitor'] and len(words) == 4 \
+                and words[3].isdigit():
+            current = monitors.setdefault(int(words[3]), {})
+        elif words[:4] == ['ip', 'sla', 'monitor', 'reaction-configuration']:
+            # e.g. react timeout threshold-type consecutive 3 action-type trap
+            current = None
+            entry = monitors.setdefault(int(words[4]), {})
+            if 'timeout' in words and 'consecutive' in words:
+                entry['consecutive'] = int(words[words.index('consecutive') + 1])
+        elif words[0] == 'ip':
+            # Schedule, logging and other global commands
+            current = None
+        elif current is None:
+            continue
+        elif words[0] == 'type':
+            current['type'] = ' '.join(words[1:])
+            if 'ipIcmpEcho' in words:
+                current['mode'] = 'icmp'
+                current['host'] = words[words.index('ipIcmpEcho') + 1]
+            elif words[1] == 'dns' and 'name-server' in words:
+                current['mode'] = 'dns'
+                current['host'] = words[words.index('target-addr') + 1]
+                current['dns'] = words[words.index('name-server') + 1]
+            if 'source-ipaddr' in words:
+                current['source'] = words[words.index('source-ipaddr') + 1]
+        elif words[0] in ('timeout', 'threshold', 'frequency'):
+            current[words[0]] = int(words[1])
+        elif words[0] == 'tag':
+            current['tag'] = ' '.join(words[1:])
+    return monitors
+
+
+def compileIpSla(text, args):
+    # Compiles IP SLA monitors into a probe plan. Probes sharing a source
+    # address and a frequency are grouped: a group is checked in the same
+    # scheduler slot, batching its probes on the shared engine sockets.
+    groups = []
+    byKey = {}
+    monitors = parseIpSla(text)
+    for number in sorted(monitors):
+        monitor = dict(ipslaDefaults, **monitors[number])
+        if 'mode' not in monitor:
+            logging.error(logStr.format('Unsupported IP SLA monitor:',
+                                        '{} {}'.format(number,
+                                                       monitor.get('type'))))
+            continue
+        probe = {'name': 'ipsla-{}'.format(number),
+                 'host': monitor['host'],
+                 'mode': monitor['mode'],
+                 'timeout': monitor['timeout'] / 1000.0,
+                 'threshold': monitor['threshold'],
+                 'dampening': monitor.get('consecutive', args.dampening)}
+        for key in ('dns', 'tag'):
+            if key in monitor:
+                probe[key] = monitor[key]
+        key = (monitor.get('source'), monitor['frequency'])
+        if key not in byKey:
+            byKey[key] = {'source': key[0], 'interval': key[1], 'probes': []}
+            groups.append(byKey[key])
+        byKey[key]['probes'].append(probe)
+    return {'groups': groups}
+
+
+def probeSettings(args, probe):
+    # Settings of a probe, defaulting to the command line ones
+    settings = argparse.Namespace()
+    for key in probeKeys:
+        default = None
+        if key not in ('name', 'host'):
+            default = getattr(args, key, None)
+        setattr(settings, key, probe.get(key, default))
+    return settings
+
+
+def nameServers(value):
+    # Name-servers of a DNS probe, a list or a comma separated string, as a
+    # comma separated string
+    if not value:
+        return None
+    if not isinstance(value, (list, tuple)):
+        value = str(value).split(',')
+    return ','.join(server.strip() for server in value if server.strip())
+
+
+def planProbes(plan, args, origin):
+    # Settings of the probes of a plan. Group settings (e.g. the source and
+    # interval of a compiled IP SLA group) apply to all the probes of the
+    # group, unless a probe overrides them.
+    probes = []
+    defaults = plan.get('defaults', {})
+    groups = list(plan.get('groups', []))
+    if 'probes' in plan:
+        groups.append({'probes': plan['probes']})
+    for number, group in enumerate(groups):
+        shared = dict(defaults)
+        shared.update((key, value) for key, value in group.items()
+                      if key != 'probes')
+        if 'source' in group or 'interval' in group:
+            shared['group'] = '{}:{}'.format(origin, number)
+        for probe in group['probes']:
+            settings = probeSettings(args, dict(shared, **probe))
+            error = probeError(settings)
+            if error:
+                logging.error(logStr.format('Invalid probe:', '{} ({})'.format(
+                    error, settings.name or settings.host)))
+                continue
+            probes.append(settings)
+    return probes
+
+
+def probeError(settings):
+    if not settings.host:
+        return 'missing host'
+    if settings.mode not in modes:
+        return 'unsupported mode {}'.format(settings.mode)
+    if settings.mode == 'dns' and not settings.dns:
+        return 'missing DNS name-server'
+    if settings.mode == 'dns' and \
+            str(settings.record or 'A').upper() not in dnsRecords:
+        return 'unsupported DNS record type {}'.format(settings.record)
+    if not settings.interval or float(settings.interval) <= 0:
+        return 'the interval must be greater than 0'
+    if settings.burst is not None and int(settings.burst) < 1:
+        return 'a burst must hold at least 1 echo'
+    if settings.mode == 'tcp' and not 0 < int(settings.port or 0) < 0x10000:
+        return 'invalid TCP port {}'.format(settings.port)
+    if settings.priority is not None and settings.priority not in priorities:
+        return 'unsupported priority {}'.format(settings.priority)
+    return None
+
+
+def readInventory(path):
+    # Inventory of probes, in JSON or, when PyYAML is installed, YAML:
+    # {"defaults": {...}, "probes": [{...}, ...], "groups": [{...}, ...]}
+    with open(path) as f:
+        text = f.read()
+    if path.endswith(('.yml', '.yaml')):
+        if yaml is None:
+            raise ValueError('PyYAML is required to read ' + path)
+        return yaml.safe_load(text) or {}
+    return json.loads(text)
+
+
+def loadProbes(args):
+    # Settings of all the probes to check: hosts of the command line, IP SLA
+    # configuration and inventory file
+    probes = [probeSettings(args, {'host': host}) for host in args.host]
+    if args.ipsla:
+        with open(args.ipsla) as f:
+            plan = compileIpSla(f.read(), args)
+        probes += planProbes(plan, args, 'ipsla')
+    if args.config:
+        probes += planProbes(readInventory(args.config), args, 'config')
+    return probes
+
+
+def formatResponse(response):
+    # ICMP latencies are numeric (ms), DNS responses are IP addresses
+    if isinstance(response, float):
+        return '{:.3f} ms'.format(response)
+    return response
+
+
+class Target(object):
+    # Settings of a single monitored target, its check and its recent RTTs.
+    # Targets persist from one check to the next and are kept compact for
+    # large fleets: with __slots__, the target and its check cost less than
+    # targetBudget bytes (see footprint()). Its RTT history ring of 4 bytes
+    # per sample, percentile sketch, burst or HTTP connection, configuration
+    # strings, dampening state (in the DampeningTable) and entries in the
+    # Monitor indexes and scheduler come on top.
+    __slots__ = ('index', 'name', 'host', 'mode', 'source', 'dns', 'timeout',
+                 'interval', 'dampening', 'threshold', 'tag', 'group', 'ip',
+                 'due', 'busy', 'removed', 'probe', 'rtts', 'rttCount', 'sketch',
+                 'burst')
+
+    def __init__(self, index, settings):
+        self.index = index
+        self.name = settings.name or settings.host
+        self.host = settings.host
+        self.mode = settings.mode
+        self.source = settings.source
+        self.dns = nameServers(settings.dns)
+        self.probe = None
+        self.configure(settings)
+        # Targets of a same plan group share their first scheduler slot
+        self.group = settings.group
+        # IP@ of the host, resolved on the first native ICMP probe
+        self.ip = None
+        # Time the next check is due, whether one is running, and whether
+        # the target was removed from the configuration
+        self.due = 0
+        self.busy = False
+        self.removed = False
+        # Ring of the last RTTs (ms), rttCount being the amount recorded
+        self.rtts = array.array('f', [0.0]) * rttHistory
+        self.rttCount = 0
+        # Streaming RTT percentiles, when enabled
+        self.sketch = None
+        if percentileWindow:
+            self.sketch = LatencySketch(timer())
+
+    def configure(self, settings):
+        # Settings which can change without resetting the target state
+        self.timeout = float(settings.timeout)
+        self.interval = float(settings.interval)
+        self.dampening = int(settings.dampening)
+        self.threshold = None
+        if settings.threshold is not None:
+            self.threshold = float(settings.threshold)
+        self.tag = settings.tag
+        # DNS, TCP and HTTP settings are kept by the check itself
+        probe = None
+        if self.mode == 'dns':
+            probe = CheckDNS(self.dns, self.source, self.host, self.timeout,
+                             settings.record, settings.expect, settings.race)
+        elif self.mode == 'tcp':
+            probe = CheckTCP(self.host, self.source, settings.port,
+                             settings.banner, self.timeout)
+        elif self.mode == 'http':
+            probe = CheckHTTP(self.host, self.source, self.timeout,
+                              settings.status, settings.insecure)
+        # Several echos per check, only for the native ICMP probes
+        self.burst = None
+        if self.mode == 'icmp' and int(settings.burst or 1) > 1:
+            self.burst = Burst(settings)
+        # The check is rebuilt with the new timeout
+        self.probe = probe
+
+    def identity(self):
+        # A target whose identity changes is a new target
+        port = self.probe.port if self.mode == 'tcp' else None
+        return (self.host, self.mode, self.source, self.dns, port)
+
+    def check(self, osSettings=None):
+        # The check object is created once and reused for every probe
+        if self.probe is None:
+            if self.mode == 'icmp':
+                self.probe = checkICMP(osSettings, self.host, self.source,
+                                       self.timeout)
+        return self.probe
+
+    def record(self, rtt, now):
+        self.rtts[self.rttCount % len(self.rtts)] = rtt
+        self.rttCount += 1
+        if self.sketch is not None:
+            self.sketch.record(rtt, now)
+
+    def history(self):
+        # Recorded RTTs, oldest first
+        size = len(self.rtts)
+        if self.rttCount <= size:
+            return self.rtts[:self.rttCount].tolist()
+        start = self.rttCount % size
+        return (self.rtts[start:] + self.rtts[:start]).tolist()
+
+    def footprint(self):
+        # Bytes of this target object and its check only: see the class
+        # comment for what comes on top
+        size = sys.getsizeof(self) + sys.getsizeof(self.due)
+        if self.ip is not None and self.ip is not self.host:
+            size += sys.getsizeof(self.ip)
+        if self.probe is not None:
+            size += sys.getsizeof(self.probe)
+        return size
+
+    def tagged(self):
+        return ' - tag {}'.format(self.tag) if self.tag else ''
+
+    def label(self):
+        # Its name, with its host if they differ, e.g. of probes of a same
+        # host on several ports
+        if self.name == self.host:
+            return self.host
+        return '{} ({})'.format(self.name, self.host)
+
+    def transition(self, state, send, rtt, via=None, dependents=0):
+        # Notifies a change of state decided by the dampening. A target dying
+        # while its parent (via) is down is unreachable-via-parent instead.
+        # Dependents are the targets suppressed, or checked again, with it.
+        label = self.label()
+        if state == 'alive':
+            logging.error(logStr.format('Target resurrected!', label))
+            msg = 'Target {} is back to life - {} check{}'.format(
+                label, self.mode, self.tagged())
+        elif state == 'dead':
+            logging.error(logStr.format('Warning:',
+                                        'Target {} is dead'.format(label)))
+            cause = ''
+            if self.mode == 'dns' and self.probe.status:
+                # e.g. TIMEOUT, SERVFAIL or REFUSED
+                cause = ' - {}'.format(self.probe.status)
+            msg = 'Target {} is dead - {} check{}{}'.format(
+                label, self.mode, cause, self.tagged())
+        elif state == 'unreachable-via-parent':
+            logging.error(logStr.format('Warning:', 'Target {} is unreachable '
+                                        'via {}'.format(label, via)))
+            msg = 'Target {} is unreachable via parent {} - {} check{}'.format(
+                label, via, self.mode, self.tagged())
+        elif state == 'degraded' and rtt == float('inf'):
+            cause = ''
+            if self.mode == 'dns' and self.probe.status:
+                # e.g. MISMATCH, or the name-servers lagging or failing
+                cause = ' ({})'.format(self.probe.status)
+            logging.error(logStr.format('Warning:', 'Target {} is degraded, '
+                                        'unexpected answer{}'.format(
+                                            label, cause)))
+            msg = 'Target {} is degraded - unexpected answer{} - {} ' \
+                  'check{}'.format(label, cause, self.mode, self.tagged())
+        elif state == 'degraded':
+            logging.error(logStr.format('Warning:', 'Target {} is degraded, '
+                                        'RTT {} ms'.format(label, rtt)))
+            msg = 'Target {} is degraded - RTT {} ms over {} ms - {} ' \
+                  'check{}'.format(label, rtt, self.threshold, self.mode,
+                                   self.tagged())
+        else:
+            logging.error(logStr.format('Target recovered!', label))
+            msg = 'Target {} is no longer degraded - {} check{}'.format(
+                label, self.mode, self.tagged())
+        if rtt is not None and (math.isnan(rtt) or math.isinf(rtt)):
+            rtt = None
+        fields = {'target': self.host, 'name': self.name, 'mode': self.mode,
+                  'state': state, 'rtt': rtt, 'tag': self.tag,
+                  'source': self.source, 'ip': self.ip}
+        if via is not None:
+            fields['parent'] = via
+        if dependents:
+            msg += ' - {} dependent target{} {}'.format(
+                dependents, 's' if dependents > 1 else '',
+                'checked again' if state == 'alive' else 'suppressed')
+            fields['dependents'] = dependents
+        send.syslog(msg, fields)
+
+
+class LatencySketch(object):
+    # Streaming RTT percentiles of a target in constant memory. RTTs are
+    # counted in a log-linear histogram (HDR-like): sketchSubBuckets buckets
+    # per power of 2 of microseconds, from 16 usec to 16.7 sec, i.e. within
+    # 12.5% of the actual value. A single histogram holds the current window
+    # and the previous ones decayed: its counts are halved at the end of each
+    # window, so that the last complete window weighs half the current one.
+    # Recording an RTT costs O(1).
+    __slots__ = ('start', 'counts', 'maxCurrent', 'maxPrevious')
+
+    def __init__(self, now):
+        self.start = now
+        self.counts = array.array('H', sketchZeros)
+        self.maxCurrent = 0.0
+        self.maxPrevious = 0.0
+
+    def rotate(self, now):
+        elapsed = now - self.start
+        if elapsed < percentileWindow:
+            return
+        windows = int(elapsed / percentileWindow)
+        counts = self.counts
+        if windows < 16:
+            for index in range(len(counts)):
+                counts[index] >>= windows
+        else:
+            counts[:] = sketchZeros
+        # The max of the last complete window, 0 if nothing was recorded
+        self.maxPrevious = self.maxCurrent if windows == 1 else 0.0
+        self.maxCurrent = 0.0
+        self.start += windows * percentileWindow
+
+    def record(self, rtt, now):
+        self.rotate(now)
+        mantissa, exponent = math.frexp(rtt * 1000)
+        index = (exponent - 1 - sketchMinExponent) * sketchSubBuckets + \
+            int((mantissa * 2 - 1) * sketchSubBuckets)
+        index = min(max(index, 0), len(sketchZeros) - 1)
+        if self.counts[index] < 0xffff:
+            self.counts[index] += 1
+        if rtt > self.maxCurrent:
+            self.maxCurrent = rtt
+
+    def percentiles(self, quantiles, now):
+        # RTTs (ms) at the quantiles, None when nothing was recorded
+        self.rotate(now)
+        counts = self.counts
+        total = sum(counts)
+        if not total:
+            return [None] * len(quantiles)
+        highest = max(self.maxCurrent, self.maxPrevious)
+        results = []
+        for quantile in quantiles:
+            rank = quantile * total
+            seen = 0
+            for index, count in enumerate(counts):
+                seen += count
+                if count and seen >= rank:
+                    break
+            octave, sub = divmod(index, sketchSubBuckets)
+            # Middle of the bucket, in ms, at most the max when it falls in
+            # the bucket (older windows have none)
+            scale = 2.0 ** (octave + sketchMinExponent) / 1000
+            value = scale * (1 + (sub + 0.5) / sketchSubBuckets)
+            if highest >= scale * (1 + float(sub) / sketchSubBuckets):
+                value = min(value, highest)
+            results.append(round(value, 3))
+        return results
+
+    def summary(self, now):
+        # p50, p90, p99 and max of the window, in ms
+        p50, p90, p99 = self.percentiles((0.5, 0.9, 0.99), now)
+        highest = None
+        if p50 is not None:
+            highest = round(max(self.maxCurrent, self.maxPrevious), 3)
+        return {'p50': p50, 'p90': p90, 'p99': p99, 'max': highest}
+
+
+class Burst(object):
+    # Echos sent in one check of an ICMP target, tightly paced, and their
+    # statistics: loss, interarrival jitter (RFC 3550, the RTT difference of
+    # consecutive replies smoothed across bursts) and reordering (replies
+    # arriving after a later echo's). The check succeeds while the loss stays
+    # within the tolerance, so a single lost echo of a lossy but usable path
+    # does not count as a failure.
+    # While the control plane is stressed (see Throttle), a burst sends only
+    # its share 'factor' of the echos.
+    __slots__ = ('count', 'sent', 'spacing', 'tolerance', 'rtts', 'arrivals',
+                 'remaining', 'jitter', 'loss', 'reordered')
+    factor = 1.0
+
+    def __init__(self, settings):
+        self.count = int(settings.burst)
+        self.spacing = float(settings.spacing) / 1000
+        self.tolerance = float(settings.loss)
+        self.jitter = 0.0
+        self.loss = None
+        self.reordered = 0
+        self.start()
+
+    def start(self):
+        # RTT (ms) of each echo, None until answered, and echo indexes in the
+        # order of their replies
+        self.sent = max(1, int(self.count * Burst.factor))
+        self.rtts = [None] * self.sent
+        self.arrivals = []
+        self.remaining = self.sent
+
+    def answered(self, index, rtt):
+        self.rtts[index] = rtt
+        if self.arrivals:
+            last = self.rtts[self.arrivals[-1]]
+            self.jitter += (abs(rtt - last) - self.jitter) * jitterGain
+        self.arrivals.append(index)
+        self.remaining -= 1
+
+    def lost(self, index):
+        self.remaining -= 1
+
+    def result(self):
+        # (alive, response, average RTT) of the completed burst
+        replies = [rtt for rtt in self.rtts if rtt is not None]
+        self.loss = round(100.0 * (self.sent - len(replies)) / self.sent, 1)
+        highest = -1
+        self.reordered = 0
+        for index in self.arrivals:
+            if index < highest:
+                self.reordered += 1
+            highest = max(highest, index)
+        response = '{}/{} replies, {}% loss, jitter {:.3f} ms, {} ' \
+                   'reordered'.format(len(replies), self.sent, self.loss,
+                                      self.jitter, self.reordered)
+        if not replies or self.loss > self.tolerance:
+            return False, response, None
+        return True, response, round(sum(replies) / len(replies), 3)
+
+    def summary(self):
+        return {'loss': self.loss, 'jitter': round(self.jitter, 3),
+                'reordered': self.reordered}
+
+
+class DampeningTable():
+    # Dampening counters and states of all the targets, by target index.
+    # With NumPy a whole tick of check results is evaluated in one vectorized
+    # step; without it, or for small batches, in a loop of the same logic.
+    #   dead       consecutive failures (dampeningDead)
+    #   alive      successes while recovering (dampeningAlive)
+    #   wasAlive   state of the target
+    #   slow       consecutive successes over the RTT threshold
+    #   fast       successes under the threshold while degraded
+    #   degraded   whether the target is degraded
+    #   dampening  dampening amount of the target, for both states
+    #   priority   priority class of the target (index in priorities)
+    #   threshold  RTT threshold of the target (ms), unbounded when none
+    #   confirm    interval (s) of the checks confirming a change of state
+    #   backoff    longest interval (s) of the checks of a dead target
+    # (0 for both when unused)
+    #   changed    time (epoch) of the last change of state notified, 0 if none
+    #   rtt        last RTT (ms) of the target, NaN if none
+    # An infinite RTT marks a success with a wrong answer (e.g. DNS), which
+    # counts as over any threshold.
+    counters = ('dead', 'alive', 'slow', 'fast', 'dampening', 'priority')
+    unbounded = 3.0e38
+    flags = ('wasAlive', 'degraded')
+    periods = ('threshold', 'confirm', 'backoff')
+    stamps = ('changed', 'rtt')
+
+    def __init__(self, size=1024):
+        self.size = 0
+        for name in self.counters + self.flags + self.periods + self.stamps:
+            setattr(self, name, None)
+        self.grow(size)
+
+    def grow(self, size):
+        if size <= self.size:
+            return
+        size = max(size, self.size * 2)
+        extra = size - self.size
+        for name in self.counters + self.flags + self.periods + self.stamps:
+            default = self.unbounded if name == 'threshold' else 0
+            if name == 'rtt':
+                default = float('nan')
+            if numpy is not None:
+                if name in self.counters:
+                    more = numpy.zeros(extra, numpy.int32)
+                elif name in self.flags:
+                    more = numpy.zeros(extra, numpy.bool_)
+                elif name in self.stamps:
+                    more = numpy.full(extra, default, numpy.float64)
+                else:
+                    more = numpy.full(extra, default, numpy.float32)
+                if self.size:
+                    more = numpy.concatenate((getattr(self, name), more))
+            else:
+                if name in self.counters:
+                    more = array.array('i', [0]) * extra
+                elif name in self.flags:
+                    more = array.array('b', [0]) * extra
+                elif name in self.stamps:
+                    more = array.array('d', [default]) * extra
+                else:
+                    more = array.array('f', [default]) * extra
+                if self.size:
+                    more = getattr(self, name) + more
+            setattr(self, name, more)
+        self.size = size
+
+    def reset(self, target, settings):
+        # A new target is assumed alive and not degraded
+        index = target.index
+        self.grow(index + 1)
+        for name in self.counters:
+            getattr(self, name)[index] = 0
+        self.wasAlive[index] = True
+        self.degraded[index] = False
+        self.changed[index] = 0
+        self.rtt[index] = float('nan')
+        self.configure(target, settings)
+
+    def configure(self, target, settings):
+        self.dampening[target.index] = target.dampening
+        threshold = target.threshold
+        self.threshold[target.index] = \
+            self.unbounded if threshold is None else threshold
+        self.confirm[target.index] = float(settings.confirm or 0)
+        self.priority[target.index] = \
+            priorities.index(settings.priority or 'normal')
+        self.backoff[target.index] = float(settings.backoff or 0)
+
+    def cadence(self, target):
+        # Interval until the next check of a target: the confirm interval
+        # while a change of state is being dampened, an interval doubling
+        # with each failure of a dead target up to the backoff, else the
+        # interval of the target
+        index = target.index
+        interval = target.interval
+        confirm = float(self.confirm[index])
+        if self.wasAlive[index]:
+            if confirm and self.dead[index]:
+                return min(confirm, interval)
+            return interval
+        if self.alive[index]:
+            return min(confirm, interval) if confirm else interval
+        backoff = float(self.backoff[index])
+        if backoff > interval:
+            failures = int(self.dead[index] - self.dampening[index])
+            return min(interval * 2 ** min(max(failures, 0), 30), backoff)
+        return interval
+
+    def recovering(self, index):
+        # Whether a success of this dead target is still being dampened
+        return not self.wasAlive[index] and \
+            self.alive[index] < self.dampening[index]
+
+    def evaluate(self, indexes, results, rtts):
+        # Applies one check result, and its RTT (ms, NaN if none), per target
+        # and returns the (index, state) of the targets which changed state:
+        # 'alive', 'dead', 'degraded' or 'normal'
+        if numpy is not None and len(indexes) >= vectorizeMinimum:
+            return self.evaluateVector(indexes, results, rtts)
+        return self.evaluateLoop(indexes, results, rtts)
+
+    def evaluateLoop(self, indexes, results, rtts):
+        changed = []
+        for index, result, rtt in zip(indexes, results, rtts):
+            if result:
+                # Dead dampening count re-initialising
+                self.dead[index] = 0
+                if not self.wasAlive[index]:
+                    # Was dead, is now coming back to life. Dampening kicks in.
+                    if self.alive[index] < self.dampening[index]:
+                        self.alive[index] += 1
+                    else:
+                        # The dampening is completed, target resurrected
+                        self.wasAlive[index] = True
+                        self.alive[index] = 0
+                        changed.append((index, 'alive'))
+            else:
+                # Looks like dead. Dampening in progress
+                self.dead[index] += 1
+                # Alive dampening count re-initialising
+                self.alive[index] = 0
+                if self.wasAlive[index] and \
+                        self.dead[index] >= self.dampening[index]:
+                    self.wasAlive[index] = False
+                    changed.append((index, 'dead'))
+
+            # Degradation, dampened the same way on the RTT of successes
+            if result and rtt > self.threshold[index]:
+                self.slow[index] += 1
+                self.fast[index] = 0
+                if not self.degraded[index] and \
+                        self.slow[index] >= self.dampening[index]:
+                    self.degraded[index] = True
+                    changed.append((index, 'degraded'))
+            elif result and self.degraded[index]:
+                # The same count clears it
+                self.slow[index] = 0
+                self.fast[index] += 1
+                if self.fast[index] >= self.dampening[index]:
+                    self.degraded[index] = False
+                    self.fast[index] = 0
+                    changed.append((index, 'normal'))
+            else:
+                self.slow[index] = 0
+                self.fast[index] = 0
+        return changed
+
+    def evaluateVector(self, indexes, results, rtts):
+        # Same transitions as evaluateLoop(), a target appearing only once
+        indexes = numpy.asarray(indexes, numpy.intp)
+        result = numpy.asarray(results, numpy.bool_)
+        rtt = numpy.asarray(rtts, numpy.float64)
+        wasAlive = self.wasAlive[indexes]
+        alive = self.alive[indexes]
+        dampening = self.dampening[indexes]
+
+        recovering = result & ~wasAlive
+        resurrected = recovering & (alive >= dampening)
+        dead = numpy.where(result, 0, self.dead[indexes] + 1)
+        died = ~result & wasAlive & (dead >= dampening)
+        alive = numpy.where(recovering & ~resurrected, alive + 1, 0)
+        alive = numpy.where(result & wasAlive, self.alive[indexes], alive)
+        self.dead[indexes] = dead
+        self.alive[indexes] = alive
+        self.wasAlive[indexes] = (wasAlive | resurrected) & ~died
+
+        degraded = self.degraded[indexes]
+        fast = self.fast[indexes]
+        with numpy.errstate(invalid='ignore'):
+            slowResult = result & (rtt > self.threshold[indexes])
+        healing = result & ~slowResult & degraded
+        healed = healing & (fast + 1 >= dampening)
+        slow = numpy.where(slowResult, self.slow[indexes] + 1, 0)
+        worsened = slowResult & ~degraded & (slow >= dampening)
+        self.slow[indexes] = slow
+        self.fast[indexes] = numpy.where(healing & ~healed, fast + 1, 0)
+        self.degraded[indexes] = (degraded | worsened) & ~healed
+
+        changed = []
+        for mask, state in ((resurrected, 'alive'), (died, 'dead'),
+                            (worsened, 'degraded'), (healed, 'normal')):
+            changed.extend((index, state) for index in indexes[mask].tolist())
+        return changed
+
+
+class Poller():
+    # Waits on many sockets at once: epoll on Linux (EOS), poll elsewhere.
+    # Each registered file descriptor has its own handler(fd, event).
+    def __init__(self):
+        self.epoll = hasattr(select, 'epoll')
+        self.poller = select.epoll() if self.epoll else select.poll()
+        self.handlers = {}
+
+    def register(self, fd, handler, events=select.POLLIN):
+        self.handlers[fd] = handler
+        self.poller.register(fd, events)
+
+    def modify(self, fd, events):
+        self.poller.modify(fd, events)
+
+    def unregister(self, fd):
+        self.handlers.pop(fd, None)
+        self.poller.unregister(fd)
+
+    def poll(self, timeout):
+        # timeout in seconds, None to wait for the next event
+        if self.epoll:
+            timeout = -1 if timeout is None else timeout
+        elif timeout is not None:
+            timeout = timeout * 1000
+        try:
+            events = self.poller.poll(timeout)
+        except (IOError, OSError, select.error) as e:
+            # Python 2 does not retry when interrupted by a signal
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        for fd, event in events:
+            handler = self.handlers.get(fd)
+            if handler:
+                handler(fd, event)
+
+
+class CheckPool():
+    # Runs the blocking checks (ping command fallback) in worker threads.
+    # Results are handed back to the polling thread through a pipe.
+    def __init__(self, osSettings, workers, poller, done):
+        self.osSettings = osSettings
+        self.workers = workers
+        self.done = done
+        self.threads = 0
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.wakeRead, self.wakeWrite = os.pipe()
+        poller.register(self.wakeRead, self.process)
+
+    def submit(self, target, now):
+        if self.threads < self.workers:
+            # Workers are started on demand, up to the configured amount
+            threading.stack_size(workerStackSize)
+            worker = threading.Thread(target=self.worker)
+            worker.daemon = True
+            worker.start()
+            self.threads += 1
+        self.jobs.put(target)
+
+    def worker(self):
+        while True:
+            target = self.jobs.get()
+            try:
+                # Check alive (True/False) and response (latency or DNS IP@)
+                alive, response = target.check(self.osSettings).isAlive()
+            except Exception as e:
+                logging.info(logStr.format('Check error:',
+                                           '{} ({})'.format(e, target.host)))
+                alive, response = False, ''
+            self.results.put((target, alive, response))
+            os.write(self.wakeWrite, b'.')
+
+    def process(self, fd, event):
+        os.read(fd, 4096)
+        while True:
+            try:
+                target, alive, response = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.done(target, alive, response)
+
+    def expire(self, now):
         pass
 
-    # def snmp():
-        # To be defined
-    #    pass
+    def nextDeadline(self):
+        return None
+
+
+class Resolver():
+    # Resolves the names of the targets in worker threads, so that a slow or
+    # dead name-server never holds the polling thread. Addresses are cached
+    # for resolveTtl then resolved again in the background, the targets
+    # keeping the previous one meanwhile; failures are cached for
+    # resolveNegativeTtl, the checks of the name failing at once.
+    def __init__(self, poller, ready):
+        self.ready = ready
+        self.threads = 0
+        # host -> (address or None, error, expiry), and the targets waiting
+        # for the resolution of each host
+        self.cache = {}
+        self.waiting = {}
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.wakeRead, self.wakeWrite = os.pipe()
+        poller.register(self.wakeRead, self.process)
+
+    def resolve(self, target, now):
+        # Returns whether the target has its address, else it is handed to
+        # ready() once resolved
+        if target.ip is target.host:
+            return True
+        entry = self.cache.get(target.host)
+        if entry is None and self.literal(target.host):
+            # Share the string when the host is an IP@
+            target.ip = target.host
+            return True
+        if entry is not None and entry[0] is not None:
+            if entry[2] <= now:
+                # Stale: kept until resolved again
+                self.lookup(target.host, now)
+            target.ip = entry[0]
+            return True
+        if entry is not None and entry[1] is not None and entry[2] > now:
+            self.ready(target, None, entry[1])
+            return False
+        self.waiting.setdefault(target.host, []).append(target)
+        self.lookup(target.host, now)
+        return False
+
+    def literal(self, host):
+        try:
+            socket.inet_pton(socket.AF_INET, host)
+            return True
+        except (socket.error, ValueError):
+            return False
+
+    def lookup(self, host, now):
+        entry = self.cache.get(host)
+        if entry is not None and entry[2] == float('inf'):
+            # In progress
+            return
+        self.cache[host] = (entry[0] if entry else None, None, float('inf'))
+        if self.threads < resolverWorkers:
+            threading.stack_size(workerStackSize)
+            worker = threading.Thread(target=self.worker)
+            worker.daemon = True
+            worker.start()
+            self.threads += 1
+        self.jobs.put(host)
+
+    def worker(self):
+        while True:
+            host = self.jobs.get()
+            try:
+                self.results.put((host, socket.gethostbyname(host), None))
+            except (socket.error, UnicodeError) as e:
+                self.results.put((host, None, e))
+            os.write(self.wakeWrite, b'.')
+
+    def process(self, fd, event):
+        os.read(fd, 4096)
+        now = timer()
+        while True:
+            try:
+                host, address, error = self.results.get_nowait()
+            except queue.Empty:
+                return
+            previous = self.cache[host][0]
+            if address is not None:
+                self.cache[host] = (address, None, now + resolveTtl)
+            elif previous is not None:
+                # Kept, resolved again later
+                logging.info(logStr.format('Resolution error:', '{} ({}), '
+                                           'keeping {}'.format(error, host,
+                                                               previous)))
+                self.cache[host] = (previous, None, now + resolveNegativeTtl)
+            else:
+                self.cache[host] = (None, error, now + resolveNegativeTtl)
+            for target in self.waiting.pop(host, ()):
+                self.ready(target, address or previous, error)
+
+
+class Engine():
+    # In-flight bookkeeping shared by the non-blocking engines. Each request
+    # waiting for a reply is keyed by the engine and has an entry of
+    # (target, send time, deadline, data); the requests which did not get any
+    # reply are reaped in deadline order.
+    def __init__(self, poller, done):
+        self.poller = poller
+        self.done = done
+        self.inflight = {}
+        # Heap of (deadline, key)
+        self.deadlines = []
+
+    def track(self, key, target, sent, data):
+        # A check never outlives the next slot of its target, so that a
+        # timeout as long as the interval does not skip every other check
+        deadline = min(sent + target.timeout, target.due)
+        self.inflight[key] = (target, sent, deadline, data)
+        heapq.heappush(self.deadlines, (deadline, key))
+
+    def expire(self, now):
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, key = heapq.heappop(self.deadlines)
+            entry = self.inflight.get(key)
+            if entry is None or entry[2] != deadline:
+                # Already answered, the key may have been reused since
+                continue
+            del self.inflight[key]
+            self.timedOut(entry)
+
+    def nextDeadline(self):
+        return self.deadlines[0][0] if self.deadlines else None
+
+    def failed(self, target, error):
+        logging.info(logStr.format('Check error:',
+                                   '{} ({})'.format(error, target.host)))
+        self.done(target, False, '')
+
+
+class IcmpEngine(Engine):
+    # Probes all the ICMP targets from one shared socket per source address.
+    # Replies are matched back to their target by ICMP identifier and
+    # sequence, the in-flight data being None, or (burst, index) for the
+    # echos of a burst. The echos following the first one of a burst are
+    # paced by a heap of (send time, order, target, burst, index).
+    # Send times are taken on the monotonic timer() and receive times from
+    # the kernel stamps when available; the correction they bring to the
+    # RTTs (ms) is summed up for the report.
+    def __init__(self, poller, done):
+        Engine.__init__(self, poller, done)
+        self.sockets = {}
+        self.byFd = {}
+        self.paced = []
+        self.order = itertools.count()
+        self.stamped = False
+        self.replies = 0
+        self.corrected = 0.0
+        self.correctionMax = 0.0
+        # Fails early when ICMP sockets are not permitted
+        IcmpSocket().close()
+
+    def socket(self, source):
+        sock = self.sockets.get(source)
+        if sock is None:
+            sock = IcmpSocket(source)
+            # Room for the replies of thousands of probes in flight. As root
+            # the buffer can be sized beyond net.core.rmem_max.
+            for option in (soRcvBufForce, socket.SO_RCVBUF):
+                try:
+                    sock.sock.setsockopt(socket.SOL_SOCKET, option,
+                                         icmpBufferSize)
+                    break
+                except (socket.error, TypeError):
+                    pass
+            self.sockets[source] = sock
+            self.byFd[sock.fileno()] = sock
+            self.poller.register(sock.fileno(), self.process)
+            self.stamped = sock.stamped
+            logging.info(logStr.format('Receive timestamps:', 'kernel'
+                                       if sock.stamped else 'user space'))
+        return sock
+
+    def submit(self, target, now):
+        try:
+            data = None
+            burst = target.burst
+            if burst is not None:
+                burst.start()
+                data = (burst, 0)
+            self.echo(target, data)
+        except socket.error as e:
+            self.failed(target, e)
+            return
+        if burst is not None:
+            for index in range(1, burst.sent):
+                heapq.heappush(self.paced, (now + index * burst.spacing,
+                                            next(self.order), target, burst,
+                                            index))
+
+    def echo(self, target, data):
+        # Sends one echo to the resolved target and tracks it
+        sock = self.socket(target.source)
+        ident, seq = sock.nextKey(self.inflight)
+        sent = timer()
+        sock.send(target.ip, seq, ident)
+        self.track((ident, seq), target, sent, data)
+
+    def expire(self, now):
+        while self.paced and self.paced[0][0] <= now:
+            when, order, target, burst, index = heapq.heappop(self.paced)
+            try:
+                self.echo(target, (burst, index))
+            except socket.error as e:
+                logging.info(logStr.format('Check error:', '{} ({})'.format(
+                    e, target.host)))
+                self.lost(target, burst, index)
+        Engine.expire(self, now)
+
+    def nextDeadline(self):
+        deadline = Engine.nextDeadline(self)
+        if self.paced and (deadline is None or self.paced[0][0] < deadline):
+            return self.paced[0][0]
+        return deadline
+
+    def process(self, fd, event):
+        for ident, seq, ip, received, correction in self.byFd[fd].drain():
+            entry = self.inflight.get((ident, seq))
+            if entry is None or entry[0].ip != ip:
+                # Reply to another process or to an already expired probe
+                continue
+            if received > entry[2]:
+                # Too late, left for expire() to report
+                continue
+            del self.inflight[(ident, seq)]
+            target, sent, deadline, data = entry
+            rtt = round((received - sent) * 1000, 3)
+            correction *= 1000
+            self.replies += 1
+            self.corrected += correction
+            if correction > self.correctionMax:
+                self.correctionMax = correction
+            logging.debug(logStr.format('Timestamp correction:', '{:.3f} ms '
+                                        '({})'.format(correction, target.host)))
+            if data is None:
+                self.done(target, True, rtt)
+                continue
+            burst, index = data
+            burst.answered(index, rtt)
+            self.complete(target, burst)
+
+    def timestamps(self):
+        # Average and highest correction (ms) of the RTTs by kernel stamps
+        average = self.corrected / self.replies if self.replies else 0.0
+        return {'engine': 'icmp',
+                'timestamps': 'kernel' if self.stamped else 'user space',
+                'replies': self.replies, 'correction': round(average, 3),
+                'correctionMax': round(self.correctionMax, 3)}
+
+    def timedOut(self, entry):
+        target, sent, deadline, data = entry
+        if data is not None:
+            self.lost(target, data[0], data[1])
+            return
+        logging.info(logStr.format('The ICMP check did not succeed',
+                                   target.host))
+        self.done(target, False, 0)
+
+    def lost(self, target, burst, index):
+        burst.lost(index)
+        self.complete(target, burst)
+
+    def complete(self, target, burst):
+        # Reports the burst once every echo is answered or lost
+        if burst.remaining:
+            return
+        alive, response, latency = burst.result()
+        if not alive:
+            logging.info(logStr.format('The ICMP burst did not succeed',
+                                       '{} ({})'.format(response, target.host)))
+        self.done(target, alive, response, latency)
+
+
+def serialLess(a, b):
+    # SOA serial comparison (RFC 1982): whether serial a is behind serial b
+    return 0 < (b - a) % (1 << 32) < 1 << 31
+
+
+class DnsRound(object):
+    # The queries of one check sent at once to several name-servers: the
+    # check completes when all of them answered or timed out, or, racing, on
+    # the first valid answer. Results are (status, RTT ms, answer, valid)
+    # by name-server.
+    __slots__ = ('remaining', 'results', 'complete')
+
+    def __init__(self, count):
+        self.remaining = count
+        self.results = {}
+        self.complete = False
+
+    def add(self, server, status, rtt=None, answer='', valid=False):
+        self.results[server] = (status, rtt, answer, valid)
+        self.remaining -= 1
+
+    def conclude(self, check):
+        # (alive, response, latency, valid) of the check, and the status of
+        # each name-server for the report. Answering name-servers behind the
+        # highest SOA serial are lagging, which invalidates the check.
+        answered = [(rtt, server, answer, valid) for server,
+                    (status, rtt, answer, valid) in self.results.items()
+                    if rtt is not None and status in ('NOERROR', 'MISMATCH')]
+        serials = {}
+        if check.options[3] == 'SOA':
+            serials = dict((server, int(answer)) for rtt, server, answer, valid
+                           in answered)
+        servers = {}
+        errors = []
+        for server in check.options[0]:
+            status, rtt, answer, valid = self.results.get(
+                server, ('SKIPPED', None, '', True))
+            if server in serials and any(serialLess(serials[server], serial)
+                                         for serial in serials.values()):
+                status = 'LAGGING'
+            servers[server] = {'status': status, 'rtt': rtt}
+            if server in serials:
+                servers[server]['serial'] = serials[server]
+            if status not in ('NOERROR', 'SKIPPED'):
+                errors.append('{} {}'.format(server, status))
+        check.status = ', '.join(errors) or 'NOERROR'
+        if not answered:
+            return False, '', None, True, servers
+        if check.options[5]:
+            # The fastest valid answer wins
+            rtt, server, answer, valid = min(answered, key=lambda answer:
+                                             (not answer[3], answer[0]))
+        else:
+            rtt = max(answered)[0]
+            server, answer, valid = min(answered)[1:]
+            valid = valid and not errors
+        return True, '{} from {}'.format(answer, server), rtt, valid, servers
+
+
+class DnsEngine(Engine):
+    # Keeps many DNS queries in flight on one UDP socket per (name-server,
+    # source) pair, matched back to their target by DNS message ID. The
+    # in-flight data is (CheckDNS, DnsRound, name-server) of the target, the
+    # round being None with a single name-server. The status of each
+    # name-server of the last round of a target is kept by target index.
+    def __init__(self, poller, done):
+        Engine.__init__(self, poller, done)
+        self.sockets = {}
+        self.byFd = {}
+        self.servers = {}
+
+    def socket(self, nameserver, source):
+        sock = self.sockets.get((nameserver, source))
+        if sock is None:
+            family = socket.AF_INET6 if ':' in nameserver else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            if source:
+                sock.bind((source, 0))
+            # Connected, so the kernel drops datagrams of other senders
+            sock.connect((nameserver, 53))
+            sock.setblocking(False)
+            self.sockets[(nameserver, source)] = sock
+            self.byFd[sock.fileno()] = sock
+            self.poller.register(sock.fileno(), self.process)
+        return sock
+
+    def nextId(self, fd):
+        for i in range(64):
+            queryId = random.getrandbits(16)
+            if (fd, queryId) not in self.inflight:
+                return queryId
+        raise socket.error(errno.ENOBUFS, 'DNS in-flight table is full')
+
+    def submit(self, target, now):
+        # All the name-servers are queried at once, the check lasting as
+        # long as the slowest of them
+        check = target.check()
+        servers = check.options[0]
+        dnsRound = None
+        if len(servers) > 1:
+            dnsRound = DnsRound(len(servers))
+        for server in servers:
+            try:
+                sock = self.socket(server, target.source)
+                queryId = self.nextId(sock.fileno())
+                wire = check.queryWire(queryId)
+                sent = timer()
+                sock.send(wire)
+            except (socket.error, dns.exception.DNSException) as e:
+                if dnsRound is None:
+                    self.failed(target, e)
+                    return
+                logging.info(logStr.format('Check error:', '{} ({} via {})'
+                                           .format(e, target.host, server)))
+                dnsRound.add(server, 'ERROR')
+                self.conclude(target, check, dnsRound)
+                continue
+            self.track((sock.fileno(), queryId), target, sent,
+                       (check, dnsRound, server))
+
+    def process(self, fd, event):
+        sock = self.byFd[fd]
+        for i in range(1024):
+            try:
+                wire = sock.recv(65535)
+            except socket.error:
+                # Would block, or an ICMP error from the name-server
+                return
+            received = timer()
+            try:
+                response = dns.message.from_wire(wire)
+            except dns.exception.DNSException:
+                continue
+            entry = self.inflight.get((fd, response.id))
+            if entry is None or received > entry[2] or \
+                    not entry[3][0].isResponse(response):
+                continue
+            del self.inflight[(fd, response.id)]
+            target, sent, deadline, (check, dnsRound, server) = entry
+            if dnsRound is not None and dnsRound.complete:
+                # Lost the race
+                continue
+            latency = round((received - sent) * 1000, 3)
+            logging.debug(logStr.format('DNS reply:', '{} in {} ms ({})'.format(
+                dns.rcode.to_text(response.rcode()), latency, target.host)))
+            alive, response, valid = check.evaluate(response)
+            if dnsRound is None:
+                self.done(target, alive, response, latency, valid)
+                continue
+            dnsRound.add(server, check.status, latency, response, valid)
+            if alive and valid and check.options[5]:
+                dnsRound.remaining = 0
+            self.conclude(target, check, dnsRound)
+
+    def conclude(self, target, check, dnsRound):
+        if dnsRound.remaining or dnsRound.complete:
+            return
+        dnsRound.complete = True
+        alive, response, latency, valid, servers = dnsRound.conclude(check)
+        self.servers[target.index] = servers
+        logging.info(logStr.format('DNS servers:', '{} ({})'.format(
+            ', '.join('{} {}{}'.format(server, result['status'],
+                                       '' if result['rtt'] is None else
+                                       ' in {} ms'.format(result['rtt']))
+                      for server, result in sorted(servers.items())),
+            target.host)))
+        self.done(target, alive, response, latency, valid)
+
+    def timedOut(self, entry):
+        target, sent, deadline, (check, dnsRound, server) = entry
+        if dnsRound is not None:
+            if not dnsRound.complete:
+                dnsRound.add(server, 'TIMEOUT')
+                self.conclude(target, check, dnsRound)
+            return
+        logging.info(logStr.format('The DNS query timed out', target.host))
+        check.status = 'TIMEOUT'
+        self.done(target, False, '')
+
+
+class TcpEngine(Engine):
+    # Connects to many TCP targets at once, each connection being keyed by
+    # its file descriptor and registered with the poller until it completes.
+    # The latency is the connect time; when a banner is expected, the
+    # in-flight data (socket, connect time, received) keeps the connection
+    # until the first line of the server is read.
+    def submit(self, target, now):
+        check = target.check()
+        try:
+            sock = check.connection(target.ip)
+        except socket.error as e:
+            self.failed(target, e)
+            return
+        sent = timer()
+        error = sock.connect_ex((target.ip, check.port))
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            self.failed(target, os.strerror(error))
+            return
+        fd = sock.fileno()
+        self.poller.register(fd, self.process, select.POLLOUT)
+        self.track(fd, target, sent, (sock, None, b''))
+
+    def process(self, fd, event):
+        entry = self.inflight.get(fd)
+        if entry is None:
+            return
+        target, sent, deadline, (sock, latency, received) = entry
+        if latency is None:
+            # Connection completed, or refused
+            error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                self.close(fd)
+                self.failed(target, os.strerror(error))
+                return
+            latency = round((timer() - sent) * 1000, 3)
+            if not target.check().banner:
+                self.close(fd)
+                self.done(target, True, latency)
+                return
+            self.poller.modify(fd, select.POLLIN)
+            self.inflight[fd] = (target, sent, deadline, (sock, latency, b''))
+            return
+        try:
+            data = sock.recv(512)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            self.close(fd)
+            self.failed(target, e)
+            return
+        received += data
+        if data and b'\n' not in received and len(received) < 512:
+            self.inflight[fd] = (target, sent, deadline,
+                                 (sock, latency, received))
+            return
+        self.close(fd)
+        alive, line = target.check().evaluate(received)
+        self.done(target, alive, line, latency)
+
+    def close(self, fd):
+        sock = self.inflight.pop(fd)[3][0]
+        self.poller.unregister(fd)
+        sock.close()
+
+    def timedOut(self, entry):
+        target, sent, deadline, (sock, latency, received) = entry
+        self.poller.unregister(sock.fileno())
+        sock.close()
+        if latency is None:
+            logging.info(logStr.format('The TCP connect timed out',
+                                       target.host))
+        else:
+            logging.info(logStr.format('No banner received', target.host))
+        self.done(target, False, '')
+
 
-    def syslog(self, msg):
-        name = 'does_it_live'
-        syslog.openlog(name, 0, syslog.LOG_LOCAL4)
-        syslog.syslog(syslogFormat + ': Log msg: %s' % msg)
+class RateLimiter():
+    # Global token buckets of the checks, in packets and bytes per second,
+    # so that our own probes stay under the control plane policing (CoPP)
+    # of the switches, whatever their type. Critical checks always go, the
+    # buckets then owing the tokens to the next ones. Normal checks wait for
+    # their tokens, low ones also for a reserve left to the others, in
+    # order. A check still waiting when the next one is due is shed: it is
+    # never run, so never counted as a failure, and the one waiting stands
+    # for the next one.
+    def __init__(self, pps=None, bps=None):
+        self.rates = [float(pps or 0), float(bps or 0)]
+        self.depths = [rate * rateDepth for rate in self.rates]
+        self.tokens = list(self.depths)
+        # Share of the rates allowed (see Throttle)
+        self.factor = 1.0
+        self.last = timer()
+        self.waiting = [collections.deque() for priority in priorities]
+        # Priority of the targets waiting
+        self.queued = {}
+        self.admitted = [0] * len(priorities)
+        self.deferred = [0] * len(priorities)
+        self.shed = [0] * len(priorities)
+
+    def refill(self, now):
+        elapsed = max(now - self.last, 0)
+        self.last = now
+        for bucket, rate in enumerate(self.rates):
+            if rate:
+                self.tokens[bucket] = min(self.tokens[bucket] +
+                                          elapsed * rate * self.factor,
+                                          self.depths[bucket])
+
+    def needs(self, cost, priority):
+        # Tokens of each bucket a check needs, a check larger than a bucket
+        # going when it is full
+        needs = []
+        for bucket, rate in enumerate(self.rates):
+            need = cost[bucket]
+            if priority == len(priorities) - 1:
+                need += lowReserve * self.depths[bucket]
+            needs.append(min(need, self.depths[bucket]) if rate else 0)
+        return needs
+
+    def admit(self, cost, priority, now):
+        self.refill(now)
+        needs = self.needs(cost, priority)
+        if priority and any(tokens < need
+                            for tokens, need in zip(self.tokens, needs)):
+            return False
+        for bucket, rate in enumerate(self.rates):
+            if rate:
+                self.tokens[bucket] -= cost[bucket]
+        self.admitted[priority] += 1
+        return True
+
+    def request(self, target, cost, priority, now):
+        # Whether a check can go now, else it waits behind those of its
+        # priority and over
+        if (not priority or not any(self.waiting[:priority + 1])) and \
+                self.admit(cost, priority, now):
+            return True
+        self.deferred[priority] += 1
+        self.waiting[priority].append((target, cost))
+        self.queued[target] = priority
+        return False
+
+    def overdue(self, target):
+        # Whether a target busy is waiting, its check then shed
+        priority = self.queued.get(target)
+        if priority is None:
+            return False
+        self.shed[priority] += 1
+        logging.debug(logStr.format('Check shed:', target.host))
+        return True
+
+    def release(self, now):
+        # Returns the waiting checks which can go
+        released = []
+        for priority, waiting in enumerate(self.waiting):
+            while waiting:
+                target, cost = waiting[0]
+                if not target.removed and not self.admit(cost, priority, now):
+                    # The next ones, and those of lower priorities, wait too
+                    return released
+                waiting.popleft()
+                del self.queued[target]
+                if not target.removed:
+                    released.append(target)
+        return released
+
+    def nextDeadline(self):
+        # When the first check waiting gets its tokens
+        for priority, waiting in enumerate(self.waiting):
+            if waiting:
+                needs = self.needs(waiting[0][1], priority)
+                delay = max([(need - tokens) / (rate * self.factor)
+                             for need, tokens, rate
+                             in zip(needs, self.tokens, self.rates) if rate] +
+                            [0])
+                return self.last + delay
+        return None
+
+    def counters(self):
+        return {'admitted': dict(zip(priorities, self.admitted)),
+                'deferred': dict(zip(priorities, self.deferred)),
+                'shed': dict(zip(priorities, self.shed)),
+                'waiting': sum(len(waiting) for waiting in self.waiting),
+                'tokens': [round(tokens, 1) for tokens in self.tokens]}
+
+
+def dropCount(data):
+    # Sum of the packet drop counters of an eAPI reply, whatever its layout
+    # (e.g. 'dropPackets' per CoPP class and interface), bytes excluded
+    total = 0
+    if isinstance(data, dict):
+        for key, value in data.items():
+            if isinstance(value, (int, float)) and \
+                    not isinstance(value, bool) and 'drop' in key.lower() \
+                    and 'byte' not in key.lower():
+                total += value
+            else:
+                total += dropCount(value)
+    elif isinstance(data, list):
+        for value in data:
+            total += dropCount(value)
+    return total
+
+
+class EApiClient(object):
+    # Commands of the local eAPI, as in lanz_history
+
+    def __init__(self):
+        url = '%s://%s:%s@localhost/command-api' % \
+              (eapiMethod, eapiUsername, eapiPassword)
+        self.client = jsonrpclib.Server(url)
+        try:
+            self.runEnableCmds([])
+        except socket.error as e:
+            raise IOError('eAPI unavailable at {} ({})'.format(
+                url.replace(':%s@' % eapiPassword, ':*@'), e))
+
+    def runEnableCmds(self, cmds, mode='json'):
+        return self.client.runCmds(
+            1, [{'cmd': 'enable', 'input': eapiEnablePassword}] + cmds,
+            mode)[1:]
+
+    def controlPlane(self):
+        # CPU usage (%) and CoPP drops (packets) of the switch
+        top, copp = self.runEnableCmds([
+            'show processes top once',
+            'show policy-map copp copp-system-policy'])
+        cpu = 100 - float(top['cpuInfo']['%Cpu(s)']['idle'])
+        return cpu, dropCount(copp)
+
+
+class Throttle():
+    # Self-throttling on the load of the control plane. Its CPU usage and
+    # CoPP drops are read from the local eAPI every eapiPollInterval, in the
+    # background. While the CPU is over 'high' or CoPP drops packets, the
+    # factor of the probe rate is halved at each reading, down to
+    # throttleFloor; once the CPU is under throttleCalm of 'high' without
+    # drops, doubled back up to 1. The Monitor stretches the intervals and
+    # scales the rate limit and bursts by the factor, and the failures seen
+    # while throttled are flagged, the deaths they cause withheld for a while:
+    # our own load is not an outage.
+    def __init__(self, high, client=None):
+        self.high = high
+        self.client = client or EApiClient()
+        self.factor = 1.0
+        self.cpu = None
+        self.drops = None
+        self.polls = 0
+        self.errors = 0
+        self.flagged = 0
+        poller = threading.Thread(target=self.poller)
+        poller.daemon = True
+        poller.start()
+
+    def poller(self):
+        while True:
+            try:
+                self.sample(*self.client.controlPlane())
+            except Exception as e:
+                # The last factor holds until the next reading
+                self.errors += 1
+                logging.info(logStr.format('eAPI error:', e))
+            time.sleep(eapiPollInterval)
+
+    def sample(self, cpu, drops):
+        dropped = self.drops is not None and drops > self.drops
+        self.polls += 1
+        self.cpu = cpu
+        self.drops = drops
+        factor = self.factor
+        if cpu >= self.high or dropped:
+            factor = max(factor / 2, throttleFloor)
+        elif cpu < self.high * throttleCalm:
+            factor = min(factor * 2, 1.0)
+        if factor != self.factor:
+            logging.error(logStr.format('Throttling:', 'probe rate x{} (CPU '
+                                        '{:.0f}%, CoPP drops {})'.format(
+                                            factor, cpu, drops)))
+        self.factor = factor
+
+    def counters(self):
+        return {'factor': self.factor, 'cpu': self.cpu, 'coppDrops': self.drops,
+                'flagged': self.flagged, 'polls': self.polls,
+                'errors': self.errors}
+
+
+class Checkpoint():
+    # Dampening state of the targets (state, counters, last RTT and time of
+    # the last change) saved every --state-interval in a file of fixed
+    # records mapped in memory, and restored on start: a restart neither
+    # notifies the dead targets again nor restarts a dampening in progress.
+    # The record of a target is at its index, identified by a 64-bit key of
+    # its name, host and mode. Only the records whose state changed (or RTT
+    # by over rttTolerance) are written, so that few pages of the flash are,
+    # and the counters are capped for those of dead targets not to change
+    # at every check. A record torn by a crash fails its checksum and is
+    # ignored.
+    header = struct.Struct('<8sIIIxxxxd')
+    record = struct.Struct('<QIiiiifdI')
+    words = struct.Struct('<10I')
+    magic = b'DILSTATE'
+    version = 1
+    salt = 0x5a5a5a5a
+    rttTolerance = 0.25
+    if numpy is not None:
+        dtype = numpy.dtype([('key', '<u8'), ('flags', '<u4'),
+                             ('dead', '<i4'), ('alive', '<i4'),
+                             ('slow', '<i4'), ('fast', '<i4'),
+                             ('rtt', '<f4'), ('changed', '<f8'),
+                             ('check', '<u4')])
+
+    def __init__(self, path, interval=60):
+        self.path = path
+        self.interval = interval
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.map = None
+        self.capacity = 0
+        self.stamp = 0.0
+        # Key of the target at each index, 0 for none
+        self.keys = []
+        self.saves = 0
+        self.written = 0
+        size = os.fstat(self.fd).st_size
+        if size:
+            header = os.read(self.fd, self.header.size)
+            if len(header) < self.header.size or \
+                    header[:len(self.magic)] != self.magic or \
+                    self.header.unpack(header)[1:3] != (self.version,
+                                                        self.record.size):
+                # Never overwritten: possibly another file given by mistake
+                os.close(self.fd)
+                raise IOError(errno.EINVAL, 'Not a state file of this version',
+                              path)
+            self.mapFile(size)
+            magic, version, recordSize, capacity, stamp = \
+                self.header.unpack_from(self.map, 0)
+            if size >= self.header.size + capacity * recordSize:
+                self.capacity = capacity
+                self.stamp = stamp
+        if not self.capacity:
+            # New, or cut short: started over
+            os.ftruncate(self.fd, 0)
+            self.grow(0)
+
+    def mapFile(self, size):
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.fd, size)
+
+    def grow(self, count):
+        capacity = max(count, 2 * self.capacity, 1024)
+        size = self.header.size + capacity * self.record.size
+        os.ftruncate(self.fd, size)
+        self.mapFile(size)
+        self.capacity = capacity
+        self.header.pack_into(self.map, 0, self.magic, self.version,
+                              self.record.size, capacity, self.stamp)
+
+    def key(self, target):
+        data = '{}\0{}\0{}'.format(target.name, target.host,
+                                    target.mode).encode('utf-8')
+        return (zlib.crc32(data) & 0xffffffff) << 32 | \
+            (zlib.adler32(data) & 0xffffffff)
+
+    def rekey(self, targets):
+        # After the targets changed
+        keys = [0 if target is None else self.key(target)
+                for target in targets]
+        self.keys = keys if numpy is None else numpy.array(keys, numpy.uint64)
+
+    def checksum(self, packed):
+        return (sum(self.words.unpack_from(packed)) + self.salt) & 0xffffffff
+
+    def checksums(self, records):
+        words = records.view('<u4').reshape(len(records),
+                                            self.record.size // 4)
+        return ((words[:, :-1].sum(axis=1, dtype=numpy.uint64) + self.salt) &
+                0xffffffff).astype(numpy.uint32)
+
+    def restore(self, table):
+        # Restores the state of the targets found, returns their amount
+        count = min(len(self.keys), self.capacity)
+        if numpy is not None:
+            return self.restoreVector(table, count)
+        slots = None
+        restored = 0
+        for index in range(len(self.keys)):
+            key = self.keys[index]
+            if not key:
+                continue
+            values = None
+            if index < count:
+                values = self.read(index)
+            if values is None or values[0] != key:
+                if slots is None:
+                    # The targets moved: records by key
+                    slots = {}
+                    for slot in range(self.capacity):
+                        found = self.read(slot)
+                        if found is not None:
+                            slots[found[0]] = found
+                values = slots.get(key)
+            if values is None:
+                continue
+            key, flags, dead, alive, slow, fast, rtt, changed = values
+            table.wasAlive[index] = flags & 1
+            table.degraded[index] = flags >> 1 & 1
+            table.dead[index] = dead
+            table.alive[index] = alive
+            table.slow[index] = slow
+            table.fast[index] = fast
+            table.rtt[index] = rtt
+            table.changed[index] = changed
+            restored += 1
+        return restored
+
+    def read(self, slot):
+        # Values of a valid record, None if empty or torn
+        offset = self.header.size + slot * self.record.size
+        values = self.record.unpack_from(self.map, offset)
+        if not values[0] or values[-1] != self.checksum(
+                self.map[offset:offset + self.record.size]):
+            return None
+        return values[:-1]
+
+    def restoreVector(self, table, count):
+        records = numpy.frombuffer(self.map, self.dtype, self.capacity,
+                                   self.header.size)
+        valid = (records['check'] == self.checksums(records)) & \
+            (records['key'] != 0)
+        keys = self.keys
+        slots = numpy.full(len(keys), -1, numpy.int64)
+        direct = numpy.zeros(len(keys), numpy.bool_)
+        direct[:count] = valid[:count] & (records['key'][:count] ==
+                                          keys[:count])
+        slots[direct] = numpy.nonzero(direct)[0]
+        moved = numpy.nonzero(~direct & (keys != 0))[0]
+        found = numpy.nonzero(valid)[0]
+        if len(moved) and len(found):
+            # The targets moved: records by key
+            order = numpy.argsort(records['key'][found])
+            sortedKeys = records['key'][found][order]
+            where = numpy.minimum(numpy.searchsorted(sortedKeys, keys[moved]),
+                                  len(found) - 1)
+            match = sortedKeys[where] == keys[moved]
+            slots[moved[match]] = found[order][where[match]]
+        if direct.all():
+            # The targets did not move
+            indexes = slice(0, len(keys))
+            found = records[:len(keys)]
+        else:
+            indexes = numpy.nonzero(slots >= 0)[0]
+            found = records[slots[indexes]]
+        table.wasAlive[indexes] = (found['flags'] & 1).astype(numpy.bool_)
+        table.degraded[indexes] = (found['flags'] >> 1 & 1).astype(numpy.bool_)
+        for name in ('dead', 'alive', 'slow', 'fast', 'rtt', 'changed'):
+            getattr(table, name)[indexes] = found[name]
+        return len(found)
+
+    def save(self, table):
+        # Writes the records which changed, returns their amount
+        count = len(self.keys)
+        if count > self.capacity:
+            self.grow(count)
+        if numpy is not None:
+            written = self.saveVector(table, count)
+        else:
+            written = 0
+            for index in range(count):
+                written += self.write(table, index)
+        self.saves += 1
+        self.written += written
+        if written:
+            self.stamp = time.time()
+            self.header.pack_into(self.map, 0, self.magic, self.version,
+                                  self.record.size, self.capacity, self.stamp)
+            self.map.flush()
+        return written
+
+    def write(self, table, index):
+        offset = self.header.size + index * self.record.size
+        dampening = table.dampening[index]
+        values = (self.keys[index],
+                  int(table.wasAlive[index]) | int(table.degraded[index]) << 1,
+                  min(table.dead[index], dampening + 31),
+                  min(table.alive[index], dampening),
+                  min(table.slow[index], dampening),
+                  min(table.fast[index], dampening), table.rtt[index],
+                  table.changed[index] if self.keys[index] else 0)
+        if not values[0]:
+            values = (0, 0, 0, 0, 0, 0, float('nan'), 0)
+        old = self.record.unpack_from(self.map, offset)
+        rtt, oldRtt = values[6], old[6]
+        if old[:6] == values[:6] and old[7] == values[7] and \
+                ((rtt != rtt and oldRtt != oldRtt) or
+                 abs(rtt - oldRtt) <= self.rttTolerance * oldRtt):
+            return 0
+        packed = self.record.pack(*(values + (0,)))
+        packed = packed[:-4] + struct.pack('<I', self.checksum(packed))
+        self.map[offset:offset + self.record.size] = packed
+        return 1
+
+    def saveVector(self, table, count):
+        new = numpy.zeros(count, self.dtype)
+        live = self.keys != 0
+        dampening = table.dampening[:count]
+        new['key'] = self.keys
+        new['flags'] = table.wasAlive[:count].astype(numpy.uint32) | \
+            table.degraded[:count].astype(numpy.uint32) << 1
+        new['dead'] = numpy.minimum(table.dead[:count], dampening + 31)
+        for name in ('alive', 'slow', 'fast'):
+            new[name] = numpy.minimum(getattr(table, name)[:count], dampening)
+        new['rtt'] = table.rtt[:count]
+        new['changed'] = table.changed[:count]
+        new[~live] = numpy.zeros(1, self.dtype)
+        new['rtt'][~live] = float('nan')
+        new['check'] = self.checksums(new)
+        old = numpy.frombuffer(self.map, self.dtype, count, self.header.size)
+        same = numpy.ones(count, numpy.bool_)
+        for name in ('key', 'flags', 'dead', 'alive', 'slow', 'fast',
+                     'changed'):
+            same &= old[name] == new[name]
+        rtt, oldRtt = new['rtt'], old['rtt']
+        with numpy.errstate(invalid='ignore'):
+            same &= (numpy.isnan(rtt) & numpy.isnan(oldRtt)) | \
+                (numpy.abs(rtt - oldRtt) <= self.rttTolerance * oldRtt)
+        dirty = numpy.nonzero(~same)[0]
+        old[dirty] = new[dirty]
+        return len(dirty)
+
+    def counters(self):
+        return {'saves': self.saves, 'written': self.written,
+                'records': len(self.keys)}
+
+
+class TimingWheel():
+    # Hierarchical timing wheel holding the next check of every target.
+    # Adding a check and advancing by one tick cost the same whatever the
+    # amount of checks scheduled: each level has 'slots' buckets and covers
+    # 'slots' times the span of the level below, whose buckets it refills
+    # (cascades) every time the lower level wraps around.
+    def __init__(self, now, resolution=None, bits=8, levels=4):
+        self.resolution = resolution or wheelResolution
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+        self.levels = levels
+        self.wheels = [[[] for i in range(1 << bits)] for l in range(levels)]
+        self.tick = int(now / self.resolution)
+        self.count = 0
+
+    def add(self, when, item):
+        tick = max(int(math.ceil(when / self.resolution)), self.tick + 1)
+        self.insert(tick, item)
+        self.count += 1
+
+    def insert(self, tick, item):
+        delta = tick - self.tick
+        for level in range(self.levels):
+            if delta < 1 << (self.bits * (level + 1)) or \
+                    level == self.levels - 1:
+                break
+        index = (tick >> (self.bits * level)) & self.mask
+        self.wheels[level][index].append((tick, item))
+
+    def cascade(self, level):
+        if level >= self.levels:
+            return
+        index = (self.tick >> (self.bits * level)) & self.mask
+        if index == 0:
+            self.cascade(level + 1)
+        bucket = self.wheels[level][index]
+        self.wheels[level][index] = []
+        for tick, item in bucket:
+            self.insert(tick, item)
+
+    def advance(self, now):
+        # Returns the items due by 'now', in order of their tick
+        due = []
+        end = int(now / self.resolution)
+        if not self.count:
+            self.tick = max(self.tick, end)
+            return due
+        while self.tick < end:
+            self.tick += 1
+            index = self.tick & self.mask
+            if index == 0:
+                self.cascade(1)
+            bucket = self.wheels[0][index]
+            if bucket:
+                self.wheels[0][index] = []
+                due.extend(item for tick, item in bucket)
+        self.count -= len(due)
+        return due
+
+    def nextDue(self):
+        # Time of the next non empty bucket of the first level, or of the
+        # next cascade. None when nothing is scheduled.
+        if not self.count:
+            return None
+        wheel = self.wheels[0]
+        for tick in range(self.tick + 1, (self.tick | self.mask) + 2):
+            if wheel[tick & self.mask]:
+                break
+        return tick * self.resolution
+
+
+class Monitor():
+    # Checks many targets concurrently from a single process. Checks are due
+    # at fixed intervals from the first one, whatever their duration, so the
+    # polling period does not drift. A target whose previous check is still
+    # running skips the slot, a slow or timed-out target never delays the
+    # others. ICMP and DNS probes of all the targets share the IcmpEngine and
+    # DnsEngine sockets; the ping command fallback runs in the worker pool.
+    # On SIGHUP the probes are reloaded and only the differences applied.
+    # The dampening state is restored from the checkpoint, if any, and saved
+    # in it at its interval.
+    def __init__(self, probes, osSettings, workers, reload=None, send=None,
+                 limiter=None, throttle=None, checkpoint=None):
+        self.targets = []
+        self.byName = {}
+        # Indexes of removed targets, for reuse
+        self.free = []
+        self.send = send or Correlator(Notice())
+        self.limiter = limiter
+        self.throttle = throttle
+        self.checkpoint = checkpoint
+        self.wheel = TimingWheel(timer())
+        self.table = DampeningTable()
+        # Dependencies: name of the parent of each target which has one, and
+        # the indexes of the children of each parent. Children of a parent
+        # down (dead, or itself blocked) are blocked, with their count of
+        # slots skipped. Those whose death was reported unreachable-via-parent
+        # are confirmed dead, or alive, once unblocked: failed checks to go.
+        self.parents = {}
+        self.children = {}
+        self.blocked = {}
+        self.unreachable = set()
+        self.confirming = {}
+        # Parent index of each child, and the children dead while their
+        # parent is failing, with their amount of dependents
+        self.parentOf = {}
+        self.deferred = {}
+        # Targets (not critical) dead while throttled, with the deadline of
+        # their notification and their amount of dependents
+        self.withheld = {}
+        # Check results waiting for the dampening evaluation
+        self.pendingIndexes = []
+        self.pendingResults = []
+        self.pendingRtts = []
+
+        self.poller = Poller()
+        self.pool = CheckPool(osSettings, workers, self.poller, self.done)
+        self.engines = [self.pool]
+        self.dns = DnsEngine(self.poller, self.done)
+        self.engines.append(self.dns)
+        self.tcp = TcpEngine(self.poller, self.done)
+        self.engines.append(self.tcp)
+        self.icmp = None
+        try:
+            self.icmp = IcmpEngine(self.poller, self.done)
+            self.engines.append(self.icmp)
+        except socket.error as e:
+            logging.info(logStr.format('Native ICMP unavailable:', e))
+        self.resolver = Resolver(self.poller, self.resolved)
+
+        self.apply(probes)
+        self.checkFootprint(osSettings)
+        if checkpoint is not None:
+            self.restore()
+            self.checkpointDue = timer() + checkpoint.interval
+        self.reload = reload
+        self.reloadPending = False
+        self.reportPending = False
+        # The signal handlers only flag the work to do, the wakeup pipe gets
+        # the loop out of poll() to do it
+        wakeRead, wakeWrite = os.pipe()
+        for fd in (wakeRead, wakeWrite):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        signal.set_wakeup_fd(wakeWrite)
+        self.poller.register(wakeRead, self.wake)
+        signal.signal(signal.SIGUSR1, self.user1)
+        if reload:
+            signal.signal(signal.SIGHUP, self.hangup)
+
+    def checkFootprint(self, osSettings):
+        # Checks the memory budget of a target, with its check built, on one
+        # target of each mode. Sizes depend on the interpreter, so a target
+        # over it is a warning.
+        measured = {}
+        for target in self.byName.values():
+            measured.setdefault(target.mode, target)
+        for mode, target in sorted(measured.items()):
+            target.check(osSettings)
+            size = target.footprint()
+            history = sys.getsizeof(target.rtts)
+            sketch = 0
+            if target.sketch is not None:
+                sketch = sys.getsizeof(target.sketch) + \
+                    sys.getsizeof(target.sketch.counts)
+            # Bursts add the size of a Burst and its lists, not counted
+            logging.info(logStr.format('Memory per target:', '{} bytes + {} '
+                                       'bytes of RTT history + {} bytes of '
+                                       'percentiles ({})'.format(
+                                           size, history, sketch, mode)))
+            if size > targetBudget:
+                logging.error(logStr.format('Warning:', 'target of {} bytes, '
+                                            'over the budget of {} bytes '
+                                            '({})'.format(size, targetBudget,
+                                                          mode)))
+
+    def restore(self):
+        # The targets restored dead are not notified again, nor their
+        # children blocked by them
+        start = timer()
+        restored = self.checkpoint.restore(self.table)
+        self.link()
+        self.unreachable = set(index for index in self.blocked
+                               if not self.table.wasAlive[index])
+        logging.info(logStr.format('State restored:', '{} targets of {} in '
+                                   '{:.1f} ms'.format(
+                                       restored, len(self.byName),
+                                       1000 * (timer() - start))))
+
+    def save(self):
+        start = timer()
+        try:
+            written = self.checkpoint.save(self.table)
+        except (IOError, OSError) as e:
+            logging.error(logStr.format('State not saved:', e))
+            return
+        logging.debug(logStr.format('State saved:', '{} records written in '
+                                    '{:.1f} ms'.format(
+                                        written, 1000 * (timer() - start))))
+
+    def hangup(self, signum, frame):
+        self.reloadPending = True
+
+    def user1(self, signum, frame):
+        self.reportPending = True
+
+    def report(self):
+        # Prints the RTT percentiles (ms) of every target, then the RTT
+        # correction brought by the kernel receive timestamps and the
+        # counters of the notifications
+        self.reportPending = False
+        now = timer()
+        for name in sorted(self.byName):
+            target = self.byName[name]
+            line = {'name': name, 'host': target.host, 'mode': target.mode,
+                    'alive': bool(self.table.wasAlive[target.index]),
+                    'degraded': bool(self.table.degraded[target.index])}
+            if target.index in self.blocked:
+                # Its dead ancestor
+                line['via'] = self.via(target.index)
+            cadence = self.table.cadence(target)
+            if cadence != target.interval:
+                line['cadence'] = cadence
+            if self.table.changed[target.index]:
+                # Time of the last change of state
+                line['since'] = float(self.table.changed[target.index])
+            if target.sketch is not None:
+                line.update(target.sketch.summary(now))
+            if target.burst is not None:
+                line.update(target.burst.summary())
+            if target.mode == 'http':
+                line.update(target.probe.summary())
+            if target.mode == 'dns':
+                line['status'] = target.probe.status
+                if target.index in self.dns.servers:
+                    line['servers'] = self.dns.servers[target.index]
+            print(json.dumps(line, sort_keys=True))
+        if self.icmp is not None:
+            print(json.dumps(self.icmp.timestamps(), sort_keys=True))
+        print(json.dumps(self.send.counters(), sort_keys=True))
+        if self.limiter is not None:
+            print(json.dumps(self.limiter.counters(), sort_keys=True))
+        if self.throttle is not None:
+            print(json.dumps(self.throttle.counters(), sort_keys=True))
+        if self.checkpoint is not None:
+            print(json.dumps(self.checkpoint.counters(), sort_keys=True))
+        sys.stdout.flush()
+
+    def wake(self, fd, event):
+        try:
+            os.read(fd, 4096)
+        except OSError:
+            pass
+
+    def apply(self, probes):
+        # Adds, updates and removes targets to match the probes. Unchanged
+        # targets, and those whose timing, dampening or tag changed, keep
+        # their state and scheduler slot.
+        added = []
+        updated = 0
+        seen = set()
+        for settings in probes:
+            name = settings.name or settings.host
+            if name in seen:
+                logging.error(logStr.format('Duplicate probe:', name))
+                continue
+            seen.add(name)
+            if settings.parent and settings.parent != name:
+                self.parents[name] = settings.parent
+            else:
+                self.parents.pop(name, None)
+            target = self.byName.get(name)
+            if target is not None:
+                port = None
+                if settings.mode == 'tcp':
+                    port = int(settings.port)
+                identity = (settings.host, settings.mode, settings.source,
+                            nameServers(settings.dns), port)
+                if target.identity() == identity:
+                    before = (target.timeout, target.interval,
+                              target.dampening, target.tag, target.threshold,
+                              self.table.confirm[target.index],
+                              self.table.backoff[target.index])
+                    target.configure(settings)
+                    self.table.configure(target, settings)
+                    if before != (target.timeout, target.interval,
+                                  target.dampening, target.tag,
+                                  target.threshold,
+                                  self.table.confirm[target.index],
+                                  self.table.backoff[target.index]):
+                        updated += 1
+                    continue
+                self.remove(target)
+            index = self.free.pop() if self.free else len(self.targets)
+            target = Target(index, settings)
+            self.table.reset(target, settings)
+            if index == len(self.targets):
+                self.targets.append(target)
+            self.targets[index] = target
+            self.byName[name] = target
+            added.append(target)
+
+        removed = [target for name, target in self.byName.items()
+                   if name not in seen]
+        for target in removed:
+            self.remove(target)
+            self.parents.pop(target.name, None)
+        self.link()
+        self.schedule(added)
+        if self.checkpoint is not None:
+            self.checkpoint.rekey(self.targets)
+        logging.info(logStr.format('Targets:', '{} added, {} updated, '
+                                   '{} removed, {} in total'.format(
+                                       len(added), updated, len(removed),
+                                       len(self.byName))))
+
+    def remove(self, target):
+        # Its scheduled check and any reply in flight are ignored
+        target.removed = True
+        self.dns.servers.pop(target.index, None)
+        self.blocked.pop(target.index, None)
+        self.unreachable.discard(target.index)
+        self.confirming.pop(target.index, None)
+        self.deferred.pop(target.index, None)
+        self.withheld.pop(target.index, None)
+        del self.byName[target.name]
+        self.targets[target.index] = None
+        self.free.append(target.index)
+
+    def link(self):
+        # Rebuilds the dependency graph, ignoring unknown parents and the
+        # links closing a cycle, then blocks the children of the parents down
+        self.children = {}
+        self.parentOf = {}
+        for name, parent in sorted(self.parents.items()):
+            child = self.byName.get(name)
+            if child is None:
+                continue
+            if parent not in self.byName:
+                logging.error(logStr.format('Unknown parent:', '{} of {}'
+                                            .format(parent, name)))
+                continue
+            ancestor = parent
+            while ancestor is not None and ancestor != name:
+                ancestor = self.parents.get(ancestor)
+            if ancestor == name:
+                logging.error(logStr.format('Dependency cycle:', '{} of {}'
+                                            .format(parent, name)))
+                continue
+            self.parentOf[child.index] = self.byName[parent].index
+            self.children.setdefault(self.byName[parent].index,
+                                     []).append(child.index)
+        for index in list(self.blocked):
+            if index not in self.parentOf:
+                self.block(index, False)
+        # Every child from the state of its current parent, parents first:
+        # a child moved to another parent by a reload is blocked or not
+        # whatever the state of its previous one
+        order = [index for index in self.children
+                 if index not in self.parentOf]
+        for parent in order:
+            down = self.down(parent)
+            for child in self.children.get(parent, ()):
+                self.block(child, down)
+                order.append(child)
+
+    def down(self, index):
+        return not self.table.wasAlive[index] or index in self.blocked
+
+    def block(self, index, blocked):
+        # Returns whether the target went down or up with it
+        down = self.down(index)
+        if blocked:
+            self.blocked.setdefault(index, 0)
+        elif self.blocked.pop(index, None) is not None and \
+                index in self.unreachable:
+            self.confirming[index] = self.targets[index].dampening
+        return self.down(index) != down
+
+    def propagate(self, index):
+        # Blocks or unblocks the children of a target, and so on down the
+        # graph while their state changes: a change costs O(children) of
+        # each target it reaches. Returns the amount of targets blocked or
+        # unblocked.
+        reached = 0
+        stack = [index]
+        while stack:
+            parent = stack.pop()
+            down = self.down(parent)
+            for child in self.children.get(parent, ()):
+                blocked = child in self.blocked
+                if self.block(child, down):
+                    stack.append(child)
+                if blocked != (child in self.blocked):
+                    reached += 1
+        return reached
+
+    def via(self, index):
+        # Name of the first dead ancestor of a blocked target
+        index = self.parentOf[index]
+        while self.table.wasAlive[index]:
+            index = self.parentOf[index]
+        return self.targets[index].name
+
+    def failing(self, index):
+        # Whether the parent of a target failed its last check
+        parent = self.parentOf.get(index)
+        return parent is not None and self.table.dead[parent] > 0
+
+    def schedule(self, targets):
+        # The first checks are spread over the first interval, the targets
+        # of a plan group sharing the same slot
+        now = timer()
+        slots = {}
+        for target in targets:
+            key = ('group', target.group)
+            if target.group is None:
+                key = ('target', target.index)
+            slots.setdefault(key, len(slots))
+        for target in targets:
+            key = ('group', target.group)
+            if target.group is None:
+                key = ('target', target.index)
+            target.due = now + target.interval * slots[key] / len(slots)
+            self.wheel.add(target.due, target)
+
+    def engine(self, target):
+        if target.mode == 'icmp' and self.icmp:
+            return self.icmp
+        if target.mode == 'dns':
+            return self.dns
+        if target.mode == 'tcp':
+            return self.tcp
+        return self.pool
+
+    def dispatch(self, target, now):
+        # The next check is due one interval (see DampeningTable.cadence())
+        # after this one was due. Slots missed while the process was held up
+        # are skipped, not caught up.
+        if target.removed:
+            return
+        if target.due > now + wheelResolution:
+            # Superseded by a check brought forward (see hasten())
+            return
+        if target.busy and (self.limiter is None or
+                            not self.limiter.overdue(target)):
+            logging.info(logStr.format('Check still in progress',
+                                       target.host))
+        interval = self.table.cadence(target)
+        if self.throttle is not None and self.table.priority[target.index]:
+            interval /= self.throttle.factor
+        target.due += interval
+        if target.due <= now:
+            missed = int((now - target.due) / interval) + 1
+            target.due += missed * interval
+        self.wheel.add(target.due, target)
+        if target.busy:
+            return
+        skipped = self.blocked.get(target.index)
+        if skipped is not None:
+            # Its parent is down: checked once every unreachableEvery slots
+            skipped += 1
+            if not unreachableEvery or skipped < unreachableEvery:
+                self.blocked[target.index] = skipped
+                return
+            self.blocked[target.index] = 0
+        target.busy = True
+        if self.limiter is not None and not self.limiter.request(
+                target, self.cost(target),
+                int(self.table.priority[target.index]), now):
+            return
+        self.submit(target, now)
+
+    def submit(self, target, now):
+        # The targets of the ICMP and TCP engines are resolved first
+        engine = self.engine(target)
+        if engine is self.pool or engine is self.dns or \
+                self.resolver.resolve(target, now):
+            engine.submit(target, now)
+
+    def resolved(self, target, address, error):
+        if target.removed:
+            target.busy = False
+            return
+        if address is None:
+            self.engine(target).failed(target, error)
+            return
+        target.ip = address
+        self.engine(target).submit(target, timer())
+
+    def cost(self, target):
+        # Packets and bytes (IP included) sent by a check: echo requests, DNS
+        # queries to each name-server, or the SYN, ACK and RST of a TCP check.
+        # An HTTP request is counted as its segment and an ACK.
+        if target.mode == 'icmp':
+            count = target.burst.count if target.burst is not None else 1
+            return (count, 40 * count)
+        if target.mode == 'dns':
+            servers = len(target.probe.options[0])
+            return (servers, servers * (46 + len(target.host)))
+        if target.mode == 'tcp':
+            return (3, 120)
+        return (2, 120 + len(target.host))
+
+    def throttled(self, now):
+        # Applies the factor of the Throttle to the rate limit and bursts.
+        # Back to normal, the targets withheld get one more check to recover.
+        factor = self.throttle.factor
+        if factor != Burst.factor:
+            if factor == 1:
+                for index, (deadline, count) in list(self.withheld.items()):
+                    self.withheld[index] = (min(deadline, now + self.table
+                                                .cadence(self.targets[index])),
+                                            count)
+            Burst.factor = factor
+            if self.limiter is not None:
+                self.limiter.factor = factor
+        for index, (deadline, count) in list(self.withheld.items()):
+            if now >= deadline:
+                # Still dead: a real outage
+                del self.withheld[index]
+                self.notify(index, 'dead', None, count, withhold=False)
+
+    def release(self, now):
+        # Checks deferred by the rate limiter which can go
+        if self.limiter is None:
+            return
+        for target in self.limiter.release(now):
+            self.submit(target, now)
+
+    def hasten(self, target, when):
+        # Brings the next check forward, the check scheduled is then ignored
+        if when < target.due:
+            target.due = when
+            self.wheel.add(when, target)
+
+    def done(self, target, alive, response, latency=None, valid=True):
+        target.busy = False
+        if target.removed:
+            return
+        if not alive and self.throttle is not None and \
+                self.throttle.factor < 1:
+            # Possibly caused by our own load on the control plane, a death
+            # is withheld
+            self.throttle.flagged += 1
+            logging.info(logStr.format('Failure while throttled:',
+                                       target.host))
+        index = target.index
+        wasAlive = self.table.wasAlive[index]
+        if alive != bool(wasAlive):
+            # A change of state being dampened is confirmed at the confirm
+            # interval, and a dead target answering is checked again at its
+            # interval, not at its backoff
+            confirm = float(self.table.confirm[index])
+            pending = self.table.alive[index] + 1 if alive else \
+                self.table.dead[index] + 1
+            if confirm and pending < self.table.dampening[index] + alive:
+                self.hasten(target, timer() + min(confirm, target.interval))
+            elif alive:
+                self.hasten(target, timer() + target.interval)
+        if latency is None and isinstance(response, float):
+            # The response of an ICMP check is its latency
+            latency = response
+        if alive:
+            if latency is not None:
+                target.record(latency, timer())
+                self.table.rtt[index] = latency
+            if latency is not None and latency is not response:
+                response = '{} in {}'.format(response, formatResponse(latency))
+            logging.info(logStr.format('Target alive. Response:',
+                                       '{} ({})'.format(formatResponse(response),
+                                                        target.host)))
+            if self.table.recovering(target.index):
+                logging.info(logStr.format('Dampening in progress',
+                                           target.host))
+        self.pendingIndexes.append(target.index)
+        self.pendingResults.append(alive)
+        if not valid:
+            latency = float('inf')
+        self.pendingRtts.append(latency if alive and latency is not None
+                                else float('nan'))
+
+    def evaluate(self):
+        # Dampening of the check results received since the last evaluation.
+        # The changes of state go through the dependency graph before they
+        # are notified, so that the children dying with their parent are
+        # reported unreachable-via-parent whatever their order.
+        if not self.pendingIndexes:
+            return
+        changed = self.table.evaluate(self.pendingIndexes, self.pendingResults,
+                                      self.pendingRtts)
+        rtts = dict(zip(self.pendingIndexes, self.pendingRtts))
+        confirmed = []
+        if self.confirming:
+            for index, alive in zip(self.pendingIndexes, self.pendingResults):
+                if index in self.confirming and not alive:
+                    self.confirming[index] -= 1
+                    if self.confirming[index] <= 0:
+                        del self.confirming[index]
+                        confirmed.append(index)
+        self.pendingIndexes = []
+        self.pendingResults = []
+        self.pendingRtts = []
+        dependents = {}
+        for index, state in changed:
+            if state in ('alive', 'dead') and index in self.children:
+                dependents[index] = self.propagate(index)
+        for index, state in changed:
+            self.notify(index, state, rtts[index], dependents.get(index, 0))
+        for index in confirmed:
+            # Still dead with its parent back: dead after all
+            if index in self.unreachable and index not in self.blocked:
+                self.unreachable.discard(index)
+                self.notify(index, 'dead', None)
+        for index, count in list(self.deferred.items()):
+            if index in self.blocked or not self.failing(index):
+                del self.deferred[index]
+                self.notify(index, 'dead', None, count)
+
+    def notify(self, index, state, rtt, dependents=0, withhold=True):
+        via = None
+        if state == 'dead' and withhold and self.throttle is not None and \
+                self.throttle.factor < 1 and self.table.priority[index]:
+            # Possibly caused by our own load: notified if still dead after
+            # throttleHold more checks, at their stretched cadence
+            cadence = self.table.cadence(self.targets[index]) / \
+                self.throttle.factor
+            self.withheld[index] = (timer() + throttleHold * cadence,
+                                    dependents)
+            return
+        if state == 'dead' and index in self.blocked:
+            state = 'unreachable-via-parent'
+            via = self.via(index)
+            self.unreachable.add(index)
+        elif state == 'dead' and self.failing(index):
+            # Dead, or unreachable-via-parent, once the parent is known
+            self.deferred[index] = dependents
+            return
+        elif state == 'alive':
+            self.unreachable.discard(index)
+            self.confirming.pop(index, None)
+            withheld = self.withheld.pop(index, None) is not None
+            if self.deferred.pop(index, None) is not None or withheld:
+                # Its death was never notified
+                return
+        self.table.changed[index] = time.time()
+        self.targets[index].transition(state, self.send, rtt, via, dependents)
+
+    def reloadProbes(self):
+        self.reloadPending = False
+        logging.info('Reloading the probes')
+        try:
+            probes = self.reload()
+        except (IOError, OSError, ValueError) as e:
+            logging.error(logStr.format('Reload failed:', e))
+            return
+        self.apply(probes)
+
+    def run(self):
+        while True:
+            if self.reloadPending:
+                self.reloadProbes()
+            if self.reportPending:
+                self.report()
+            now = timer()
+            # Timeouts first, so a check due at its previous deadline starts
+            for engine in self.engines:
+                engine.expire(now)
+            self.evaluate()
+            self.send.expire(now)
+            if self.throttle is not None:
+                self.throttled(now)
+            self.release(now)
+            for target in self.wheel.advance(now):
+                self.dispatch(target, now)
+            self.evaluate()
+            if self.checkpoint is not None and now >= self.checkpointDue:
+                self.save()
+                self.checkpointDue = now + self.checkpoint.interval
+
+            deadlines = [engine.nextDeadline() for engine in self.engines]
+            deadlines.append(self.wheel.nextDue())
+            deadlines.append(self.send.nextDeadline())
+            if self.limiter is not None:
+                deadlines.append(self.limiter.nextDeadline())
+            if self.checkpoint is not None:
+                deadlines.append(self.checkpointDue)
+            deadlines.extend(deadline for deadline, count
+                             in self.withheld.values())
+            deadlines = [d for d in deadlines if d is not None]
+            wait = None
+            if deadlines:
+                wait = max(min(deadlines) - timer(), 0)
+            self.poller.poll(wait)
+            self.evaluate()
 
 
 def main():
     global args
-    dampeningDead = 0
-    dampeningAlive = 0
-    wasAlive = True
-    
+    global rttHistory
+    global percentileWindow
+    global unreachableEvery
+
     args = parseArgs()
+    rttHistory = args.history
+    percentileWindow = args.percentiles
+    unreachableEvery = args.unreachable_every
     setLogging(args)
     argsDisplay(args)
     osSettings = checkOS()
+    if args.trap_receiver:
+        try:
+            receiveTraps(args.trap_receiver)
+        except KeyboardInterrupt:
+            print(' Interrupted! Exiting...')
+        return
+    if args.show_plan:
+        with open(args.ipsla) as f:
+            plan = compileIpSla(f.read(), args)
+        print(json.dumps(plan, indent=2, sort_keys=True))
+        return
 
     try:
-        while True:
-            if args.mode == 'icmp':
-                check = checkICMP(osSettings, args.host[0])
-            if args.mode == 'dns':
-                check = CheckDNS(args.dns, args.source, args.host[0])
-            
-            # Check alive (True/False) and response (ICMP latency or DNS IP@)
-            alive, response = check.isAlive()
-
-            send = Notice()
-            if alive:
-                logging.info(logStr.format('Target alive. Response:', response))
-                # Dead dampening count re-initialising
-                dampeningDead = 0
-                
-                if not wasAlive:
-                    # Was dead, is now coming back to life. Dampening kicks in.
-                    if (dampeningAlive < args.dampening):
-                        dampeningAlive += 1
-                        logging.info('Dampening in progress')
-                        logging.debug(logStr.format(
-                            'Remaining successes before assuming resurection:',
-                            dampeningAlive))
-                    elif (dampeningAlive == args.dampening):
-                        # The dampening is completed, target considered resurrected
-                        wasAlive = True
-                        dampeningAlive = 0
-                        logging.error('Target resurrected!')
-                        send.syslog('Target {} is back to life - {} check'.format(
-                                    args.host[0], args.mode))
-                
-            else:
-                # Looks like dead. Dampening in progress
-                dampeningDead += 1
-                # Alive dampening count re-initialising
-                dampeningAlive = 0
-
-                if wasAlive and (dampeningDead >= args.dampening):
-                    logging.error(logStr.format('Warning:', 'Target is dead'))
-                    send.syslog('Target {} is dead - {} check'.format(
-                                args.host[0], args.mode))
-                    # Death tracker
-                    wasAlive = False
-                else:
-                    # Either the target is already dead or Dampening is going on
-                    # Dampening at failure is silent (intuitive enough?)
-                    pass
-            logging.debug('')
-            time.sleep(args.interval)
+        probes = loadProbes(args)
+    except (IOError, OSError, ValueError) as e:
+        logging.error(logStr.format('Error:', e))
+        sys.exit(1)
+    reload = None
+    if args.config or args.ipsla:
+        reload = lambda: loadProbes(args)
+
+    try:
+        send = Correlator(Notice(noticeSinks(args.notify), args.queue,
+                                 args.drop), args.correlate, args.correlate_by,
+                          args.flap, args.flap_period)
+    except (IOError, OSError) as e:
+        logging.error(logStr.format('Error:', e))
+        sys.exit(1)
+    # Stopped by SIGTERM as by Ctrl-C, saving the state and sending the
+    # queued notifications
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    monitor = None
+    try:
+        limiter = None
+        if args.max_pps or args.max_bytes:
+            limiter = RateLimiter(args.max_pps, args.max_bytes)
+        throttle = None
+        if args.throttle:
+            try:
+                throttle = Throttle(args.throttle)
+            except (IOError, OSError) as e:
+                logging.error(logStr.format('Error:', e))
+                sys.exit(1)
+        checkpoint = None
+        if args.state:
+            try:
+                checkpoint = Checkpoint(args.state, args.state_interval)
+            except (IOError, OSError) as e:
+                logging.error(logStr.format('Error:', e))
+                sys.exit(1)
+        monitor = Monitor(probes, osSettings, args.workers, reload, send,
+                          limiter, throttle, checkpoint)
+        monitor.run()
     except KeyboardInterrupt:
         print(' Interrupted! Exiting...')
+        if monitor is not None and monitor.checkpoint is not None:
+            monitor.save()
+        # The last notifications, e.g. of targets which just died
+        send.close(2)
 
 
 if __name__ == '__main__':
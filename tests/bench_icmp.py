@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Loopback benchmark of the native ICMP engine: checks many targets of
+# 127.0.0.1 to 127.0.0.254 through the Monitor scheduler and prints the
+# probes per second offered and answered on a single core, and the probes
+# lost. Probes are lost once the offered rate (targets / interval) is over
+# what the core sustains. Needs native ICMP sockets (root, or
+# net.ipv4.ping_group_range including the user).
+#
+#   python tests/bench_icmp.py --targets 10000 --interval 0.3 --seconds 5
+#
+from __future__ import division, print_function
+
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+import does_it_live  # noqa: E402
+
+
+def parseArgs():
+    parser = argparse.ArgumentParser(
+        description='Loopback benchmark of the native ICMP probes')
+    parser.add_argument('--targets', type=int, default=10000,
+                        help='amount of loopback targets. Default is 10000')
+    parser.add_argument('--seconds', type=float, default=5,
+                        help='duration of the run. Default is 5')
+    parser.add_argument('--interval', type=float, default=0.3,
+                        help='interval (s) of the checks of each target. '
+                             'Default is 0.3')
+    parser.add_argument('--timeout', type=float, default=1,
+                        help='timeout (s) of a probe. Default is 1')
+    return parser.parse_args()
+
+
+def main():
+    args = parseArgs()
+    logging.basicConfig(level=logging.ERROR)
+    settings = argparse.Namespace(mode='icmp', source=None, dns=None,
+                                  timeout=args.timeout,
+                                  interval=args.interval, dampening=3,
+                                  threshold=None, tag=None, group=None,
+                                  burst=1, spacing=5, loss=50)
+    probes = [does_it_live.probeSettings(settings, {
+        'host': '127.0.0.{}'.format(1 + i % 254),
+        'name': str(i)}) for i in range(args.targets)]
+    monitor = does_it_live.Monitor(probes, does_it_live.checkOS(), 4)
+    if monitor.icmp is None:
+        print('Native ICMP sockets unavailable, nothing to measure')
+        sys.exit(1)
+    counts = {'alive': 0, 'lost': 0}
+
+    def done(target, alive, response, latency=None, valid=True):
+        target.busy = False
+        counts['alive' if alive else 'lost'] += 1
+
+    for engine in monitor.engines:
+        engine.done = done
+    # The first interval only spreads the first checks: measured after it
+    timer = does_it_live.timer
+    warmup = timer() + args.interval
+    start = None
+    end = warmup + args.seconds
+    while timer() < end:
+        now = timer()
+        if start is None and now >= warmup:
+            start = now
+            counts['alive'] = counts['lost'] = 0
+        for engine in monitor.engines:
+            engine.expire(now)
+        for target in monitor.wheel.advance(now):
+            monitor.dispatch(target, now)
+        deadlines = [engine.nextDeadline() for engine in monitor.engines]
+        deadlines.append(monitor.wheel.nextDue())
+        deadlines = [d for d in deadlines if d is not None]
+        monitor.poller.poll(max(min(deadlines + [end]) - timer(), 0))
+    elapsed = timer() - start
+    print('{} targets, {:.1f} s: {:.0f} probes/s offered, {:.0f} answered, '
+          '{} lost, Python {}'.format(args.targets, elapsed,
+                                      args.targets / args.interval,
+                                      counts['alive'] / elapsed,
+                                      counts['lost'],
+                                      sys.version.split()[0]))
+
+
+if __name__ == '__main__':
+    main()